@@ -4,6 +4,11 @@
 dashGridOptions = {
     # "pagination": True,
     # "paginationAutoPageSize": True,
+    # infinite row model - rows are served in blocks by the getRowsRequest callback
+    "rowBuffer": 0,
+    "cacheBlockSize": 100,
+    "maxBlocksInCache": 10,
+    "infiniteInitialRowCount": 1,
 }
 
 defaultColDef = {
@@ -138,7 +143,7 @@ columnDefs = [
         'field': 'standard_charge_negotiated_dollar',
         'valueFormatter': {"function": 'd3.format("$,.2f")(params.value)'},
         'cellClassRules': {
-            'calculated-data': "params.data.calculated_negotiated_dollars === true"
+            'calculated-data': "params.data && params.data.calculated_negotiated_dollars === true"
         },
         'headerTooltip': 'Values in RED are calculated from the negotiated percentage and standard charge gross',
     },
@@ -154,7 +159,7 @@ columnDefs = [
         'columnGroupShow': 'open',
         'valueFormatter': {"function": 'd3.format("$,.2f")(params.value)'},
             'cellClassRules': {
-            'calculated-data': {"function": "params.data.standard_charge_discounted_cash < params.data.standard_charge_negotiated_dollar"}
+            'calculated-data': {"function": "params.data && params.data.standard_charge_discounted_cash < params.data.standard_charge_negotiated_dollar"}
         },
     },
     {
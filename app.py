@@ -1,19 +1,106 @@
+# config first: it sets the Polars environment before polars is imported
+from config import SEARCH_RESULT_LIMIT, COMPRESS_MIN_BYTES
 import dash_mantine_components as dmc
-from dash import Dash, callback, Output, Input, State, get_asset_url, no_update, callback_context
+from dash import Dash, Output, Input, State, get_asset_url, dcc
 from dash.exceptions import PreventUpdate
+from flask import Response, abort, request
+from flask_compress import Compress
 from dash_iconify import DashIconify
-import polars as pl
-from polars import col as c
 from ui import UIComponents, schema_modal, about_modal, help_modal, hospital_modal, map_modal, distribution_modal
+import hashlib
+import json
+from uuid import uuid4
+import helpers
+import instrumentation
+import serialization
+from instrumentation import callback
+# registers the background callbacks
+import background
 from helpers import (
-    get_hcpcs_desc_list, get_product_list, filter_payment_info, add_hospital_data,
-    fetch_summarized_prices, schema_for_fig_data, create_map_visualization,
-    create_price_distribution_plot,hospitals_data,  create_html_table, no_price_table, get_hcpcs_code_from_desc
+    QueryCancelled, session_selection_frame, grid_block_json, grid_export_csv, get_hospital_info, selection_block_json,
+    selection_ready
 )
 
 
 # Initialize the app
 app = Dash(__name__)
+server = app.server
+# brotli (gzip fallback) for callback responses, grid blocks and assets; Dash's own
+# compress=True only enables gzip
+app.server.config.update(COMPRESS_ALGORITHM=['br', 'gzip'], COMPRESS_MIN_SIZE=COMPRESS_MIN_BYTES)
+Compress(app.server)
+# encode callback responses with orjson instead of plotly's JSON encoder
+serialization.install()
+# callback/stage timings, response sizes and cache stats at /metrics
+instrumentation.init_app(app.server, routes=('/grid/rows',))
+instrumentation.metrics.register_collector('cache', lambda: {
+    'result': helpers.result_cache.stats(),
+    'session_frames': helpers.session_frames.stats(),
+})
+
+
+@app.server.route('/options/<kind>.json')
+def dropdown_options(kind):
+    """
+    Serve dropdown options, revalidated by the browser through an ETag.
+
+    Without query parameters the full precomputed list is returned; `q` and `limit`
+    return the top matches of the typeahead search instead.
+    """
+    index = helpers.dataset.lookup_index
+    if kind not in index.options_json:
+        abort(404)
+    etag = f'{kind}-{index.version}'
+    if 'q' in request.args or 'limit' in request.args:
+        query = request.args.get('q', '')
+        limit = request.args.get('limit', SEARCH_RESULT_LIMIT, type=int)
+        body = json.dumps(index.search[kind].search(query, limit))
+        # each search has its own ETag, so a revalidation never returns another query's matches
+        etag += '-' + hashlib.sha256(json.dumps([query, limit]).encode()).hexdigest()[:16]
+    else:
+        body = index.options_json[kind]
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.server.route('/grid/rows', methods=['POST'])
+@instrumentation.timed('grid_rows')
+def grid_rows():
+    """
+    Serve a block of grid rows for a session's selection and grid filter as column-oriented JSON.
+
+    Expects {'request': getRowsRequest, 'selection': {'how', 'value'}, 'session_id', 'seq'}, where
+    `seq` numbers the session's requests. Once the session asks for another selection or filter,
+    its older requests skip their queued queries and come back empty (the grid has already
+    discarded them).
+
+    While the selection's background job is still collecting it, each block is queried on its
+    own with an unknown row count, so the grid fills before the job is done.
+    """
+    body = request.get_json(silent=True) or {}
+    selection = body.get('selection') or {}
+    grid_request = body.get('request') or {}
+    session_id = body.get('session_id')
+    try:
+        state = json.dumps([selection.get('how'), selection.get('value'), grid_request.get('filterModel')], sort_keys=True)
+        superseded = helpers.session_requests.begin(session_id, state, body.get('seq'))
+        if selection_ready(selection['how'], selection['value']):
+            data = session_selection_frame(
+                session_id, selection['how'], selection['value'], grid_request.get('filterModel'), cancelled=superseded
+            )
+            if superseded():
+                raise QueryCancelled
+            payload = grid_block_json(data, grid_request)
+        else:
+            payload = selection_block_json(selection['how'], selection['value'], grid_request, cancelled=superseded)
+    except QueryCancelled:
+        payload = '{"rowCount":0,"rows":0,"columns":{}}'
+    except Exception as e:
+        print(f"Error serving grid rows: {e}")
+        payload = '{"rowCount":0,"rows":0,"columns":{}}'
+    return Response(payload, mimetype='application/json')
 
 
 # Create the main layout
@@ -78,6 +165,11 @@ layout = dmc.AppShell([
         hospital_modal,
         map_modal,
         distribution_modal,
+        dcc.Store(id='selection-store'),
+        # the selection shown in the grid, set as soon as it is picked (selection-store is set once it is loaded)
+        dcc.Store(id='grid-selection-store'),
+        # the selection the charts on the page were built for (grid filter changes only patch their data then)
+        dcc.Store(id='chart-selection-store'),
     ]),
     
     dmc.AppShellFooter(UIComponents.create_footer()),
@@ -93,7 +185,14 @@ layout = dmc.AppShell([
     "id": "appshell",
 })
 
-app.layout = dmc.MantineProvider(layout)
+def serve_layout():
+    """Build the page layout with a fresh session id for the server-side grid frames"""
+    return dmc.MantineProvider([
+        layout,
+        dcc.Store(id='session-id', data=uuid4().hex),
+    ])
+
+app.layout = serve_layout
 
 # ============================================================================
 # CALLBACKS
@@ -108,23 +207,38 @@ def update_switch_text(checked):
     return dmc.Text(f"Search by {'HCPCS' if checked else 'Product'}")
 
 
-@callback(
+# Update dropdown options based on toggle selection and the typed search. Only the
+# top matches are sent to the browser, from the ETag-validated /options search route
+app.clientside_callback(
+    """
+    async function(isHcpcs, searchValue, value) {
+        const ctx = window.dash_clientside.callback_context;
+        const searched = ctx.triggered.some(t => t.prop_id === 'selection-dropdown.searchValue');
+        // the search box shows the selected label after a pick - list the defaults then
+        const query = searched && searchValue !== value ? (searchValue || '') : '';
+        try {
+            const params = new URLSearchParams({q: query, limit: %d});
+            const response = await fetch('%s' + (isHcpcs ? 'hcpcs' : 'product') + '.json?' + params);
+            const options = await response.json();
+            if (!searched) {
+                return [options, options.length ? options[0] : null];
+            }
+            if (value && !options.includes(value)) {
+                options.unshift(value);
+            }
+            return [options, window.dash_clientside.no_update];
+        } catch (e) {
+            console.error('Error updating dropdown options', e);
+            return searched ? [window.dash_clientside.no_update, window.dash_clientside.no_update] : [[], null];
+        }
+    }
+    """ % (SEARCH_RESULT_LIMIT, app.get_relative_path('/options/')),
     [Output('selection-dropdown', 'data'),
      Output('selection-dropdown', 'value')],
-    Input('switch-toggle', 'checked')
+    [Input('switch-toggle', 'checked'),
+     Input('selection-dropdown', 'searchValue')],
+    State('selection-dropdown', 'value')
 )
-def update_dropdown_options(is_hcpcs):
-    """Update dropdown options based on toggle selection"""
-    try:
-        if is_hcpcs:
-            options = get_hcpcs_desc_list()
-        else:
-            options = get_product_list()
-        
-        return options, options[0] if options else None
-    except Exception as e:
-        print(f"Error updating dropdown options: {e}")
-        return [], None
 
 
 @callback(
@@ -138,75 +252,77 @@ def toggle_navbar(opened, navbar):
     return navbar
 
 
-@callback(
-    [Output('grid', 'rowData'),
-     Output('price-info', 'children')],
-    [Input('selection-dropdown', 'value'),
-     Input('switch-toggle', 'checked')]
+# update_data_and_prices and update_visualizations run as background callbacks, see background.py
+
+
+# the grid starts filling from the picked selection while its background job loads it
+app.clientside_callback(
+    """
+    function(value, isHcpcs) {
+        return value ? {how: isHcpcs ? 'hcpcs' : 'ndc', value: value} : null;
+    }
+    """,
+    Output('grid-selection-store', 'data'),
+    Input('selection-dropdown', 'value'),
+    Input('switch-toggle', 'checked'),
 )
-def update_data_and_prices(selected_value, is_hcpcs):
-    """Update grid data and price information"""
-    if not selected_value:
-        return [], no_price_table()
-    
-    try:
-        selection_type = 'hcpcs' if is_hcpcs else 'ndc'
-        
-        # Get filtered data
-        filtered_data = (
-            filter_payment_info(selection_type, selected_value)
-            .pipe(add_hospital_data)
-            .collect(engine='streaming')
-            .to_dicts()
-        )
-        
-        # Get price data
-        lookup_value = selected_value
-        if selection_type == 'hcpcs':
-            lookup_value = get_hcpcs_code_from_desc(selected_value)
-        
-        prices = fetch_summarized_prices(how=selection_type, value=lookup_value).collect()
-        
-        if prices.is_empty():
-            prices_html = no_price_table()
-        else:
-            formatted_prices = prices.with_columns(
-                amount=pl.format('${}', c.amount)
-            ).to_dict(as_series=False)
-            prices_html = create_html_table(formatted_prices)
-        
-        return filtered_data, prices_html
-        
-    except Exception as e:
-        print(f"Error updating data: {e}")
-        return [], no_price_table()
 
 
-@callback(
-    [Output('map', 'figure'),
-     Output('price-distribution', 'figure')],
-    Input('grid', 'virtualRowData')
+# reset the infinite row model whenever the selection changes; once the selection is loaded
+# the rows are only refreshed in place, which brings in the total row count
+app.clientside_callback(
+    """
+    async function(gridSelection, selection) {
+        const api = await dash_ag_grid.getApiAsync('grid');
+        api.purgeInfiniteCache();
+        if (dash_clientside.callback_context.triggered_id === 'selection-store') {
+            return dash_clientside.no_update;
+        }
+        return {rowIndex: 0};
+    }
+    """,
+    Output('grid', 'scrollTo'),
+    Input('grid-selection-store', 'data'),
+    Input('selection-store', 'data'),
+    prevent_initial_call=True,
+)
+
+
+# fetch the requested block as columns and rebuild the row objects in the browser
+app.clientside_callback(
+    """
+    async function(request, selection, sessionId) {
+        if (!request) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        if (!selection) {
+            return {rowData: [], rowCount: 0};
+        }
+        // numbered so the server can tell a late request for an old filter from a new one
+        window.praGridSeq = (window.praGridSeq || 0) + 1;
+        const response = await fetch('%s', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({request: request, selection: selection, session_id: sessionId, seq: window.praGridSeq})
+        });
+        const block = await response.json();
+        const names = Object.keys(block.columns);
+        const rowData = new Array(block.rows);
+        for (let i = 0; i < block.rows; i++) {
+            const row = {};
+            for (const name of names) {
+                row[name] = block.columns[name][i];
+            }
+            rowData[i] = row;
+        }
+        return {rowData: rowData, rowCount: block.rowCount};
+    }
+    """ % app.get_relative_path('/grid/rows'),
+    Output('grid', 'getRowsResponse'),
+    Input('grid', 'getRowsRequest'),
+    State('grid-selection-store', 'data'),
+    State('session-id', 'data')
 )
-def update_visualizations(virtual_row_data):
-    """Update map and price distribution charts"""
-    if not virtual_row_data:
-        raise PreventUpdate
-        
-    try:
-        data = pl.DataFrame(
-            virtual_row_data, 
-            schema=schema_for_fig_data(), 
-            strict=False
-        ).lazy()
-        
-        map_fig = create_map_visualization(data)
-        dist_plot = create_price_distribution_plot(data)
-        
-        return map_fig, dist_plot
-        
-    except Exception as e:
-        print(f"Error updating visualizations: {e}")
-        raise PreventUpdate
 
 
 @callback(
@@ -242,13 +358,19 @@ def toggle_grid_section(n_clicks):
 
 
 @callback(
-    Output("grid", "exportDataAsCsv"),
+    Output("csv-download", "data"),
     Input("csv-button", "n_clicks"),
+    State("selection-store", "data"),
+    State("grid", "filterModel"),
+    State("session-id", "data"),
     prevent_initial_call=True
 )
-def export_csv(n_clicks):
-    """Export grid data to CSV"""
-    return True if n_clicks else False
+def export_csv(n_clicks, selection, filter_model, session_id):
+    """Export the filtered grid data to CSV"""
+    if not n_clicks or not selection:
+        raise PreventUpdate
+    data = session_selection_frame(session_id, selection['how'], selection['value'], filter_model).lazy()
+    return dcc.send_string(grid_export_csv(data), "hospital_data.csv")
 
 
 @callback(
@@ -262,80 +384,49 @@ def toggle_schema_modal(n_clicks, opened):
     return not opened
 
 ##add callback to expand map to full screen
-
-@callback(
+# the modal graphs reuse the inline figures client-side instead of rebuilding them
+
+app.clientside_callback(
+    """
+    function(n_clicks, figure, opened) {
+        const triggered = window.dash_clientside.callback_context.triggered.map(t => t.prop_id);
+        // Only toggle modal if the expand button was clicked
+        if (triggered.includes('expand-map-btn.n_clicks') && n_clicks) {
+            return [!opened, figure];
+        }
+        // If triggered by a new map figure, just update the figure, don't open modal
+        return [window.dash_clientside.no_update, figure];
+    }
+    """,
     Output("map-modal", "opened"),
     Output("map-modal-graph", "figure"),
     Input("expand-map-btn", "n_clicks"),
+    Input("map", "figure"),
     State("map-modal", "opened"),
-    Input("grid", "virtualRowData"),
     prevent_initial_call=True,
 )
-def toggle_map_modal(n_clicks, opened, virtual_row_data):
-    """Toggle map modal visibility"""
-    ctx = callback_context
-    if not virtual_row_data:
-        raise PreventUpdate
-
-    # Only toggle modal if the expand button was clicked
-    if ctx.triggered and ctx.triggered[0]["prop_id"].startswith("expand-map-btn"):
-        if not n_clicks:
-            return no_update, no_update
-        data = pl.DataFrame(
-            virtual_row_data,
-            schema=schema_for_fig_data(),
-            strict=False
-        ).lazy()
-        map_fig = create_map_visualization(data)
-        return not opened, map_fig
-    # If triggered by grid data, just update the figure, don't open modal
-    elif ctx.triggered and ctx.triggered[0]["prop_id"].startswith("grid"):
-        data = pl.DataFrame(
-            virtual_row_data,
-            schema=schema_for_fig_data(),
-            strict=False
-        ).lazy()
-        map_fig = create_map_visualization(data)
-        return no_update, map_fig
-    return no_update, no_update
 
 ##add callback to expand distribution plot to full screen
 
-@callback(
+app.clientside_callback(
+    """
+    function(n_clicks, figure, opened) {
+        const triggered = window.dash_clientside.callback_context.triggered.map(t => t.prop_id);
+        // Only toggle modal if the expand button was clicked
+        if (triggered.includes('expand-distribution-btn.n_clicks') && n_clicks) {
+            return [!opened, figure];
+        }
+        // If triggered by a new distribution figure, just update the figure, don't open modal
+        return [window.dash_clientside.no_update, figure];
+    }
+    """,
     Output("distribution-modal", "opened"),
     Output("distribution-modal-graph", "figure"),
     Input("expand-distribution-btn", "n_clicks"),
+    Input("price-distribution", "figure"),
     State("distribution-modal", "opened"),
-    Input("grid", "virtualRowData"),
     prevent_initial_call=True,
 )
-def toggle_distribution_modal(n_clicks, opened, virtual_row_data):
-    """Toggle distribution modal visibility"""
-    ctx = callback_context
-    if not virtual_row_data:
-        raise PreventUpdate
-
-    # Only toggle modal if the expand button was clicked
-    if ctx.triggered and ctx.triggered[0]["prop_id"].startswith("expand-distribution-btn"):
-        if not n_clicks:
-            return no_update, no_update
-        data = pl.DataFrame(
-            virtual_row_data,
-            schema=schema_for_fig_data(),
-            strict=False
-        ).lazy()
-        dist_fig = create_price_distribution_plot(data)
-        return not opened, dist_fig
-    # If triggered by grid data, just update the figure, don't open modal
-    elif ctx.triggered and ctx.triggered[0]["prop_id"].startswith("grid"):
-        data = pl.DataFrame(
-            virtual_row_data,
-            schema=schema_for_fig_data(),
-            strict=False
-        ).lazy()
-        dist_fig = create_price_distribution_plot(data)
-        return no_update, dist_fig
-    return no_update, no_update
 
 
 
@@ -372,12 +463,7 @@ def show_hospital_info(click_data):
     
     try:
         hospital_id = click_data['points'][0]['customdata'][3]
-        hospital_data = (
-            hospitals_data
-            .filter(c.unique_id == hospital_id)
-            .collect()
-            .to_dict(as_series=False)
-        )
+        hospital_data = get_hospital_info(hospital_id)
         
         if not hospital_data['name']:
             return [], False
@@ -417,4 +503,6 @@ def show_hospital_info(click_data):
 
 
 if __name__ == "__main__":
+    helpers.start_reloader()
+    instrumentation.start_flusher()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Heavy callbacks run as Dash background callbacks.
+
+Each job runs in its own process, so the web worker's threads stay free for the
+quick UI callbacks, progress is reported while it runs, and Dash terminates the
+job when the same callback fires again (the user picks another drug).
+
+Job processes are forked from a forkserver that imports this module without
+touching Polars: a process forked after Polars has started its thread pool hangs
+on its first parallel query (see gunicorn.conf.py). Each job opens the dataset
+itself and builds only the in-memory parts it uses, and the selection frames it
+collects are spilled to disk (helpers.spill_store) for the web workers to read.
+The chart templates are built at import, so the jobs inherit them. The callbacks
+live here rather than in app.py so the job processes can import them by name.
+"""
+import os
+import threading
+from typing import Optional
+
+import diskcache
+import multiprocess
+import psutil
+from dash import DiskcacheManager, Input, Output, State, ctx, no_update
+from dash.exceptions import PreventUpdate
+
+from config import BACKGROUND_CACHE_DIR, BACKGROUND_CACHE_EXPIRE, MAP_MAX_SVG_POINTS
+from instrumentation import callback
+from helpers import (
+    chart_figures, create_html_table, data_version, ensure_datasets, figure_patch, figure_template,
+    get_hcpcs_code_from_desc, no_price_table, price_table, selection_ready, spilled_selection_frame
+)
+
+multiprocess.set_start_method('forkserver', force=True)
+# importing the main module once in the forkserver saves every job from re-running it
+multiprocess.set_forkserver_preload(['__main__', 'background'])
+
+# built here (without Polars) so the forkserver holds them and each job starts with them
+for name in ('map', 'dense_map', 'distribution'):
+    figure_template(name)
+
+_job_start_lock = threading.Lock()
+
+
+class SpillAwareManager(DiskcacheManager):
+    """
+    DiskcacheManager that holds back a cached selection whose spilled rows have been pruned.
+
+    A cached update_data_and_prices result can outlive the spill file of its selection
+    (helpers.SpillStore removes the oldest files), which would leave the grid slicing
+    the payment data block by block. Dash starts the job even when the result is
+    cached, so while that job re-collects and re-spills the selection the cached
+    result is reported as not ready; the job then overwrites it.
+    """
+
+    def get_result(self, key, job):
+        result = self.handle.get(key, self.UNDEFINED)
+        selection = _result_selection(result)
+        if selection and job and not selection_ready(selection['how'], selection['value']) and self.job_running(job):
+            return self.UNDEFINED
+        return super().get_result(key, job)
+
+    def call_job_fn(self, key, job_fn, args, context):
+        # the forkserver is started by the first job and inherits the environment at that point;
+        # the flag makes its import skip the data load, and is only set here so the web process
+        # (and the Werkzeug reloader child started by `python app.py`) still loads the data
+        with _job_start_lock:
+            deferred = os.environ.get('PRA_DEFER_DATA_LOAD')
+            os.environ['PRA_DEFER_DATA_LOAD'] = '1'
+            try:
+                return super().call_job_fn(key, job_fn, args, context)
+            finally:
+                if deferred is None:
+                    del os.environ['PRA_DEFER_DATA_LOAD']
+                else:
+                    os.environ['PRA_DEFER_DATA_LOAD'] = deferred
+
+    def terminate_job(self, job):
+        # a job that exits between Dash's pid check and the kill has nothing left to terminate
+        try:
+            super().terminate_job(job)
+        except psutil.NoSuchProcess:
+            pass
+
+
+def _result_selection(result) -> Optional[dict]:
+    """The selection of an update_data_and_prices result, or None for any other result."""
+    if isinstance(result, (list, tuple)) and result and isinstance(result[0], dict):
+        if {'how', 'value'} <= result[0].keys():
+            return result[0]
+    return None
+
+
+# results are reused for the same inputs and data version until they expire
+background_manager = SpillAwareManager(
+    diskcache.Cache(BACKGROUND_CACHE_DIR),
+    cache_by=[data_version],
+    expire=BACKGROUND_CACHE_EXPIRE,
+)
+
+
+@callback(
+    [Output('selection-store', 'data'),
+     Output('price-info', 'children')],
+    [Input('selection-dropdown', 'value'),
+     Input('switch-toggle', 'checked')],
+    background=True,
+    manager=background_manager,
+    progress=[Output('selection-progress', 'value'), Output('selection-status', 'children')],
+    running=[(Output('selection-progress-box', 'style'), {'display': 'block'}, {'display': 'none'})],
+    interval=250,
+)
+def update_data_and_prices(set_progress, selected_value, is_hcpcs):
+    """Update the active selection and price information, loading the selection's payment rows"""
+    if not selected_value:
+        return None, no_price_table()
+
+    try:
+        ensure_datasets()
+        selection_type = 'hcpcs' if is_hcpcs else 'ndc'
+        selection = {'how': selection_type, 'value': selected_value}
+
+        # Get price data
+        set_progress((10, 'Looking up prices'))
+        lookup_value = selected_value
+        if selection_type == 'hcpcs':
+            lookup_value = get_hcpcs_code_from_desc(selected_value)
+
+        prices = price_table(selection_type, lookup_value)
+        prices_html = create_html_table(prices) if prices else no_price_table()
+
+        # collect (and spill) the payment rows the grid and charts read
+        set_progress((40, 'Loading hospital payment data'))
+        frame = spilled_selection_frame(selection_type, selected_value)
+        # the map type follows the whole selection, so grid filters only change its data
+        selection['hospitals'] = frame['hospital_unique_id'].n_unique()
+        set_progress((100, 'Done'))
+
+        return selection, prices_html
+
+    except Exception as e:
+        print(f"Error updating data: {e}")
+        return None, no_price_table()
+
+
+@callback(
+    [Output('map', 'figure'),
+     Output('price-distribution', 'figure'),
+     Output('chart-selection-store', 'data')],
+    [Input('selection-store', 'data'),
+     Input('grid', 'filterModel')],
+    State('chart-selection-store', 'data'),
+    background=True,
+    manager=background_manager,
+    # a filter change returns patches rather than figures, so the trigger is part of the cache key
+    cache_ignore_triggered=False,
+    interval=250,
+)
+def update_visualizations(selection, filter_model, chart_selection):
+    """Update map and price distribution charts"""
+    if not selection:
+        raise PreventUpdate
+
+    try:
+        ensure_datasets()
+        dense_map = selection.get('hospitals', 0) > MAP_MAX_SVG_POINTS
+        map_fig, dist_plot = chart_figures(selection['how'], selection['value'], filter_model, dense_map)
+
+        # a grid filter change only sends the charts' data when the charts on the page are this
+        # selection's; after a superseded or cancelled job they may still show the previous one
+        if 'selection-store.data' not in ctx.triggered_prop_ids and chart_selection == selection:
+            return figure_patch(map_fig, 'map'), figure_patch(dist_plot, 'distribution'), no_update
+        return map_fig, dist_plot, selection
+
+    except Exception as e:
+        print(f"Error updating visualizations: {e}")
+        raise PreventUpdate
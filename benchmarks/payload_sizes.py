@@ -0,0 +1,117 @@
+"""
+Measure the wire size of the main app responses with and without compression.
+
+Replays the chart callback (once its background job has cached the result) and the
+first grid block for a selection through the Flask test client with each
+Accept-Encoding, and times the encoding of the chart response with plotly's json
+and orjson engines and with the app's serializer:
+
+    python -m benchmarks.payload_sizes --data /tmp/pra_synthetic
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+
+ENCODINGS = ['identity', 'gzip', 'br']
+
+
+def chart_request(selection: dict) -> dict:
+    """Body of the /_dash-update-component request sent for the map and distribution charts."""
+    return {
+        'output': '..map.figure...price-distribution.figure...chart-selection-store.data..',
+        'outputs': [
+            {'id': 'map', 'property': 'figure'},
+            {'id': 'price-distribution', 'property': 'figure'},
+            {'id': 'chart-selection-store', 'property': 'data'},
+        ],
+        'inputs': [
+            {'id': 'selection-store', 'property': 'data', 'value': selection},
+            {'id': 'grid', 'property': 'filterModel', 'value': {}},
+        ],
+        'state': [{'id': 'chart-selection-store', 'property': 'data', 'value': None}],
+        'changedPropIds': ['selection-store.data'],
+    }
+
+
+def grid_request(selection: dict) -> dict:
+    """Body of the /grid/rows request for the first grid block."""
+    return {
+        'request': {'startRow': 0, 'endRow': 100, 'sortModel': [], 'filterModel': {}},
+        'selection': selection,
+        'session_id': 'benchmark',
+    }
+
+
+def background_result_path(client, path: str, body: dict) -> str:
+    """
+    Run a background callback to completion and return the URL that serves its result.
+
+    Background callbacks answer with a job id that is polled until the result is ready;
+    the result stays cached, so the poll URL can be replayed with each encoding.
+    """
+    job = client.post(path, json=body, headers={'Accept-Encoding': 'identity'}).get_json()
+    poll = f"{path}?cacheKey={job['cacheKey']}&job={job['job']}"
+    while 'response' not in (client.post(poll, json=body, headers={'Accept-Encoding': 'identity'}).get_json() or {}):
+        time.sleep(0.1)
+    return poll
+
+
+def encode_ms(encode, value, repeat: int = 20) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encode(value)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Measure PRA response sizes per encoding.")
+    parser.add_argument('--data', type=Path, help="Dataset directory (used as PRA_DATA_DIR)")
+    parser.add_argument('--hcpcs', help="HCPCS description to measure (default: the most common code)")
+    args = parser.parse_args(argv)
+
+    if args.data:
+        os.environ['PRA_DATA_DIR'] = str(args.data)
+    import app
+    import helpers
+    import serialization
+    import plotly.io as pio
+    from polars import col as c
+
+    value = args.hcpcs
+    if value is None:
+        top = helpers.dataset.payment_info.group_by(c.hcpcs).len().drop_nulls().sort('len', descending=True)
+        desc_by_code = {code: desc for desc, code in helpers.dataset.lookup_index.hcpcs_by_desc.items()}
+        value = next(desc_by_code[code] for code in top.collect()['hcpcs'] if code in desc_by_code)
+    selection = {'how': 'hcpcs', 'value': value}
+    print(f"{value}: {helpers.selection_frame('hcpcs', value).height:,} rows")
+
+    client = app.app.server.test_client()
+    client.get('/')
+    requests = {
+        'charts': (background_result_path(client, '/_dash-update-component', chart_request(selection)),
+                   chart_request(selection)),
+        'grid block': ('/grid/rows', grid_request(selection)),
+    }
+    print(f"{'response':<14}" + ''.join(f"{encoding:>12}" for encoding in ENCODINGS))
+    for name, (path, body) in requests.items():
+        sizes = []
+        for encoding in ENCODINGS:
+            response = client.post(path, json=body, headers={'Accept-Encoding': encoding})
+            sizes.append(len(response.data))
+        print(f"{name:<14}" + ''.join(f"{size:>12,}" for size in sizes))
+
+    map_fig, distribution_fig = helpers.chart_figures('hcpcs', value)
+    response = {'multi': True, 'response': {'map': {'figure': map_fig}, 'price-distribution': {'figure': distribution_fig}}}
+    encoders = {
+        'plotly json': lambda value: pio.json.to_json_plotly(value, engine='json'),
+        'plotly orjson': lambda value: pio.json.to_json_plotly(value, engine='orjson'),
+        'app (serialization.dumps)': serialization.dumps,
+    }
+    for name, encode in encoders.items():
+        print(f"chart response encode, {name}: {encode_ms(encode, response):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Benchmark the query and figure pipelines stage by stage.
+
+Points the app modules at a dataset (PRA_DATA_DIR), picks a mix of popular and
+random HCPCS / product selections and times each stage with cold caches:
+
+    python -m benchmarks.run_benchmarks --data /tmp/pra_synthetic --generate --rows 10_000_000 --build
+
+Reports p50/p90/p99/max latency and the peak memory each stage adds over the RSS
+at its start, optionally as JSON so runs can be compared before and after a data refresh.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def max_rss() -> int:
+    """Lifetime peak resident set size of this process in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (0 where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return 0
+
+
+class PeakMemory:
+    """
+    Sample the process RSS on a background thread while a stage runs.
+
+    `used` is the peak RSS during the stage minus the RSS when it started, i.e. the
+    memory the stage itself added. Where /proc is unavailable it falls back to the
+    growth of ru_maxrss (the lifetime peak), which only sees stages that raise it.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start = 0
+        self.peak = 0
+        self.used = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start = self.peak = current_rss() or max_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss() or max_rss())
+        self.used = self.peak - self.start
+        return False
+
+
+class StageTimer:
+    """Collect wall time and peak memory use (RSS growth over the stage) per named stage."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.peaks: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            yield
+            elapsed = time.perf_counter() - start
+        self.latencies.setdefault(name, []).append(elapsed)
+        self.peaks[name] = max(self.peaks.get(name, 0), memory.used)
+
+    def summary(self) -> Dict[str, dict]:
+        return {
+            name: {
+                'runs': len(samples),
+                'p50_ms': percentile(samples, 50) * 1000,
+                'p90_ms': percentile(samples, 90) * 1000,
+                'p99_ms': percentile(samples, 99) * 1000,
+                'max_ms': max(samples) * 1000,
+                'mean_ms': statistics.fmean(samples) * 1000,
+                'peak_mb': self.peaks[name] / 1024 ** 2,
+            }
+            for name, samples in self.latencies.items()
+        }
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of a non-empty sample list."""
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def pick_selections(helpers, count: int, seed: int) -> List[tuple]:
+    """
+    Choose (how, value) selections: the most paid-for HCPCS codes and products plus random ones.
+
+    Args:
+        helpers: The imported helpers module.
+        count: Selections per kind (half popular, half random).
+        seed: Random seed for the random picks.
+
+    Returns:
+        list: (how, value) tuples.
+    """
+    import polars as pl
+    from polars import col as c
+
+    rng = random.Random(seed)
+    popular = max(count // 2, 1)
+    index = helpers.dataset.lookup_index
+
+    top_hcpcs = (
+        helpers.dataset.payment_info.group_by(c.hcpcs).len().drop_nulls()
+        .sort('len', descending=True).head(popular).collect()['hcpcs'].to_list()
+    )
+    desc_by_code = {code: desc for desc, code in index.hcpcs_by_desc.items()}
+    hcpcs = [desc_by_code[code] for code in top_hcpcs if code in desc_by_code]
+    hcpcs += rng.sample(index.options['hcpcs'], min(count - len(hcpcs), len(index.options['hcpcs'])))
+
+    top_ndcs = (
+        helpers.dataset.payment_info.group_by(c.ndc).len().drop_nulls()
+        .sort('len', descending=True).head(popular).collect()['ndc']
+    )
+    products = (
+        helpers.ndc_data.filter(c.ndc.is_in(top_ndcs.implode()))
+        .select(pl.col('product').unique()).collect()['product'].to_list()[:popular]
+    )
+    products += rng.sample(index.options['product'], min(count - len(products), len(index.options['product'])))
+
+    return [('hcpcs', value) for value in hcpcs] + [('ndc', value) for value in products]
+
+
+def run_selection(helpers, timer: StageTimer, how: str, value: str):
+    """Run every pipeline stage once for a selection with cold caches."""
+    helpers.result_cache.clear()
+
+    with timer.stage('filter_payment_info'):
+        filtered = helpers.filter_payment_info(how, value).collect(engine='streaming')
+    with timer.stage('add_hospital_data'):
+        joined = helpers.add_hospital_data(filtered.lazy()).collect()
+    with timer.stage('fetch_summarized_prices'):
+        helpers.fetch_summarized_prices(how, value).collect()
+    with timer.stage('aggregate_chart_data'):
+        aggregates = helpers.aggregate_chart_data(joined.lazy())
+    with timer.stage('create_map_visualization'):
+        helpers.create_map_visualization(aggregates['hospital'])
+    with timer.stage('create_price_distribution_plot'):
+        helpers.create_price_distribution_plot(aggregates['unit'])
+    with timer.stage('chart_figures (end to end)'):
+        helpers.chart_figures(how, value)
+    return joined.height
+
+
+def print_report(summary: Dict[str, dict], meta: dict):
+    print(f"\n{meta['payment_rows']:,} payment rows, {meta['selections']} selections x {meta['repeat']} runs"
+          f" (selection rows p50 {meta['selection_rows_p50']:,}, max {meta['selection_rows_max']:,})")
+    header = f"{'stage':<32}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'peak MB':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, stats in summary.items():
+        print(f"{name:<32}{stats['p50_ms']:>10.1f}{stats['p90_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+              f"{stats['max_ms']:>10.1f}{stats['peak_mb']:>10.0f}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the PRA query and figure pipelines.")
+    parser.add_argument('--data', type=Path, required=True, help="Dataset directory (used as PRA_DATA_DIR)")
+    parser.add_argument('--generate', action='store_true', help="Generate a synthetic dataset in --data first")
+    parser.add_argument('--rows', type=lambda value: int(value.replace('_', '')), default=1_000_000,
+                        help="Payment rows to generate with --generate")
+    parser.add_argument('--build', action='store_true', help="Run the build_data steps before benchmarking")
+    parser.add_argument('--selections', type=int, default=10, help="Selections per kind (hcpcs / ndc)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per selection")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=Path, help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    # config reads PRA_DATA_DIR at import, so it is set before any app module is imported
+    os.environ['PRA_DATA_DIR'] = str(args.data)
+    if args.generate:
+        from benchmarks.synthetic_data import generate
+        start = time.perf_counter()
+        generate(args.data, args.rows, seed=args.seed)
+        print(f"generated {args.rows:,} rows in {time.perf_counter() - start:.1f}s")
+
+    if args.build:
+        # helpers picks its payment source at import, so build in a separate process first
+        subprocess.run([sys.executable, str(Path(__file__).parent.parent / 'build_data.py')], check=True)
+
+    import helpers
+
+    selections = pick_selections(helpers, args.selections, args.seed)
+    timer = StageTimer()
+    selection_rows = []
+    for _ in range(args.repeat):
+        for how, value in selections:
+            selection_rows.append(run_selection(helpers, timer, how, value))
+
+    summary = timer.summary()
+    meta = {
+        'data': str(args.data),
+        'payment_rows': helpers.dataset.payment_info.select(helpers.pl.len()).collect().item(),
+        'payment_source': str(helpers.dataset.payment_path),
+        'selections': len(selections),
+        'repeat': args.repeat,
+        'selection_rows_p50': int(statistics.median(selection_rows)),
+        'selection_rows_max': max(selection_rows),
+    }
+    print_report(summary, meta)
+    if args.json:
+        args.json.write_text(json.dumps({'meta': meta, 'stages': summary}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Synthetic PRA dataset generator for benchmarks.
+
+Writes db.parquet plus the dimension files (hospital, hospital340B, ndc_names,
+hcpcs_desc, prices) with the same file names and schemas as DATABASE/, so the app
+or the benchmark harness can be pointed at it with PRA_DATA_DIR:
+
+    python -m benchmarks.synthetic_data --rows 10_000_000 --out /tmp/pra_synthetic
+    PRA_DATA_DIR=/tmp/pra_synthetic python app.py
+
+Payment rows are produced in chunks through a Polars IO source and streamed to
+parquet, so memory stays flat from 1M up to 500M rows.
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+from polars.io.plugins import register_io_source
+
+from config import HCPCS_DESC, HOSPITAL340B, HOSPITALS, NDC_NAMES, PAYMENT_INFO, PRICE_PATH
+from data_dictionary_table_schema import schema_for_fig_data
+
+# columns added by add_hospital_data are not part of db.parquet
+HOSPITAL_COLUMNS = {'name', 'state', 'beds', 'lat', 'long'}
+PAYMENT_SCHEMA = pl.Schema({
+    name: dtype for name, dtype in schema_for_fig_data().items() if name not in HOSPITAL_COLUMNS
+})
+# the data dictionary lists it as Int64, but db.parquet stores it as Float64
+PAYMENT_SCHEMA['drug_unit_of_measurement'] = pl.Float64
+
+STATES = [
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY',
+    'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND',
+    'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY',
+]
+UNIT_TYPES = ['ML', 'UN', 'GR', 'ME', 'F2', None]
+SETTINGS = ['inpatient', 'outpatient', 'both']
+METHODOLOGIES = ['fee schedule', 'case rate', 'percent of total billed charges', 'per diem', 'other']
+PAYERS = [f'Payer {i}' for i in range(40)]
+PLANS = [f'Plan {i}' for i in range(120)]
+LOBS = ['Commercial', 'Medicare', 'Medicaid', 'Exchange', 'Workers Comp', 'Tricare', 'Hospice', 'Other']
+PROGRAM_TYPES = ['Critical Access Hospital', 'Disproportionate Share Hospital', 'Sole Community Hospital', 'Rural Referral Center']
+
+
+def _skewed_index(rng: np.random.Generator, n: int, size: int, skew: float = 3.0) -> np.ndarray:
+    """Indices in [0, size) where low indices are far more common, like popular drugs."""
+    return np.minimum((size * rng.random(n) ** skew).astype(np.int64), size - 1)
+
+
+def generate_dimensions(
+    hospitals: int = 6_000,
+    hcpcs_codes: int = 1_200,
+    products: int = 20_000,
+    ndcs_per_product: int = 2,
+    seed: int = 0,
+) -> dict:
+    """
+    Build the dimension tables.
+
+    Args:
+        hospitals: Number of hospitals.
+        hcpcs_codes: Number of HCPCS codes.
+        products: Number of products.
+        ndcs_per_product: NDCs per product.
+        seed: Random seed.
+
+    Returns:
+        dict: DataFrames keyed by 'hospital', 'hospital340B', 'hcpcs_desc', 'ndc_names', 'prices'.
+    """
+    rng = np.random.default_rng(seed)
+
+    hospital_ids = [f'{i:08x}-0000-4000-8000-{seed:012x}_synthetic' for i in range(hospitals)]
+    hospital = pl.DataFrame({
+        'unique_id': hospital_ids,
+        'name': [f'SYNTHETIC HOSPITAL {i}' for i in range(hospitals)],
+        'state': rng.choice(STATES, hospitals),
+        'beds': rng.integers(10, 1_500, hospitals).astype(str),
+        'lat': rng.uniform(25.0, 49.0, hospitals).astype(str),
+        'long': rng.uniform(-124.0, -67.0, hospitals).astype(str),
+        'hospital_url': [f'https://hospital-{i}.example.org' for i in range(hospitals)],
+        'retrieved': [f'2025-{month:02d}-{day:02d}T12:00:00.000Z' for month, day in
+                      zip(rng.integers(1, 13, hospitals), rng.integers(1, 29, hospitals))],
+    })
+    in_340b = rng.random(hospitals) < 0.15
+    hospital340b = pl.DataFrame({
+        'unique_id': np.array(hospital_ids)[in_340b],
+        'program_type_long': rng.choice(PROGRAM_TYPES, int(in_340b.sum())),
+    })
+
+    codes = [f'J{i:04d}' for i in range(hcpcs_codes)]
+    hcpcs_desc = pl.DataFrame({
+        'hcpcs': codes,
+        'hcpcs_desc': [f'{code} - Injection, synthetic drug {i}, 1 mg' for i, code in enumerate(codes)],
+    })
+
+    # every product has ndcs_per_product NDCs; ~70% of products map to a HCPCS code
+    product_names = [f'Synthetic Product {i} Injection Solution {rng.integers(1, 500)} MG/ML' for i in range(products)]
+    product_hcpcs = pl.Series(rng.choice(codes, products)).scatter(np.flatnonzero(rng.random(products) >= 0.7), None)
+    ndc_names = pl.DataFrame({
+        'ndc': [f'{i:011d}' for i in range(products * ndcs_per_product)],
+        'product': np.repeat(product_names, ndcs_per_product),
+        'hcpcs': product_hcpcs.gather(np.repeat(np.arange(products), ndcs_per_product)),
+    })
+
+    n_ndcs = ndc_names.height
+    prices = ndc_names.with_columns(
+        pl.Series('tx_unit_price', rng.lognormal(1, 2, n_ndcs)),
+        pl.Series('tx_340b', rng.lognormal(0.5, 2, n_ndcs)),
+        pl.Series('nadac', rng.lognormal(0, 2, n_ndcs)),
+        pl.when(pl.col('hcpcs').is_not_null()).then(pl.format('Synthetic drug {}', pl.col('hcpcs'))).alias('asp_desc'),
+        pl.when(pl.col('hcpcs').is_not_null()).then(pl.lit('1 MG')).alias('asp_dosage'),
+        pl.when(pl.col('hcpcs').is_not_null()).then(pl.Series(rng.lognormal(1, 2, n_ndcs))).alias('asp'),
+    )
+
+    return {
+        'hospital': hospital,
+        'hospital340B': hospital340b,
+        'hcpcs_desc': hcpcs_desc,
+        'ndc_names': ndc_names.select('ndc', 'product'),
+        'prices': prices,
+    }
+
+
+def payment_chunk(start: int, stop: int, dims: dict, seed: int = 0) -> pl.DataFrame:
+    """
+    Generate payment rows [start, stop) with PAYMENT_SCHEMA.
+
+    Each chunk is seeded from (seed, start), so the output does not depend on chunk order.
+
+    Args:
+        start: First row number.
+        stop: Row number after the last row.
+        dims: Dimension tables from generate_dimensions.
+        seed: Random seed.
+
+    Returns:
+        pl.DataFrame: The payment rows.
+    """
+    rng = np.random.default_rng([seed, start])
+    n = stop - start
+    crosswalk = dims['prices']
+    codes = crosswalk[_skewed_index(rng, n, crosswalk.height)]
+    hospital_ids = dims['hospital']['unique_id']
+
+    unit = rng.integers(0, 10, n).astype(np.float64)
+    unit[rng.random(n) < 0.05] = np.nan
+    negotiated = rng.lognormal(5, 1.5, n)
+    negotiated[rng.random(n) < 0.1] = np.nan
+    # NDC-only rows carry no HCPCS code
+    hcpcs = codes['hcpcs'].scatter(np.flatnonzero(rng.random(n) < 0.3), None)
+
+    return pl.DataFrame({
+        'description': codes['product'],
+        'ndc': codes['ndc'],
+        'hcpcs': hcpcs,
+        'setting': rng.choice(SETTINGS, n),
+        'drug_unit_of_measurement': pl.Series(unit, nan_to_null=True),
+        'drug_type_of_measurement': pl.Series(UNIT_TYPES, dtype=pl.String).gather(rng.integers(0, len(UNIT_TYPES), n)),
+        'payer_name': rng.choice(PAYERS, n),
+        'plan_name': rng.choice(PLANS, n),
+        'standard_charge_gross': rng.lognormal(6, 1, n),
+        'standard_charge_discounted_cash': rng.lognormal(5, 1, n),
+        'standard_charge_negotiated_dollar': pl.Series(negotiated, nan_to_null=True),
+        'standard_charge_methodology': rng.choice(METHODOLOGIES, n),
+        'standard_charge_negotiated_percentage': rng.random(n),
+        'calculated_negotiated_dollars': rng.random(n) < 0.2,
+        'hospital_unique_id': hospital_ids.gather(_skewed_index(rng, n, hospital_ids.len(), skew=1.5)),
+        'mapped_plan_name': rng.choice(PLANS, n),
+        'mapped_lob_name': rng.choice(LOBS, n),
+    }).cast(PAYMENT_SCHEMA)
+
+
+def payment_rows(rows: int, dims: dict, chunk_rows: int = 2_000_000, seed: int = 0) -> pl.LazyFrame:
+    """
+    Lazily produce `rows` payment rows in chunks of `chunk_rows`.
+
+    Args:
+        rows: Total number of rows.
+        dims: Dimension tables from generate_dimensions.
+        chunk_rows: Rows generated per chunk.
+        seed: Random seed.
+
+    Returns:
+        pl.LazyFrame: A streaming source of payment rows.
+    """
+    def source(with_columns, predicate, n_rows, batch_size):
+        limit = rows if n_rows is None else min(rows, n_rows)
+        for start in range(0, limit, chunk_rows):
+            chunk = payment_chunk(start, min(start + chunk_rows, limit), dims, seed)
+            if with_columns is not None:
+                chunk = chunk.select(with_columns)
+            yield chunk if predicate is None else chunk.filter(predicate)
+
+    return register_io_source(source, schema=PAYMENT_SCHEMA)
+
+
+def generate(
+    out: Path,
+    rows: int,
+    hospitals: int = 6_000,
+    hcpcs_codes: int = 1_200,
+    products: int = 20_000,
+    chunk_rows: int = 2_000_000,
+    seed: int = 0,
+) -> Path:
+    """
+    Write a complete synthetic dataset.
+
+    Args:
+        out: Output directory (created if missing).
+        rows: Number of payment rows.
+        hospitals: Number of hospitals.
+        hcpcs_codes: Number of HCPCS codes.
+        products: Number of products.
+        chunk_rows: Payment rows generated per chunk.
+        seed: Random seed.
+
+    Returns:
+        Path: The output directory.
+    """
+    out.mkdir(parents=True, exist_ok=True)
+    dims = generate_dimensions(hospitals, hcpcs_codes, products, seed=seed)
+    dims['hospital'].write_parquet(out / HOSPITALS.name)
+    dims['hospital340B'].write_parquet(out / HOSPITAL340B.name)
+    dims['hcpcs_desc'].write_parquet(out / HCPCS_DESC.name)
+    dims['ndc_names'].write_parquet(out / NDC_NAMES.name)
+    dims['prices'].write_parquet(out / PRICE_PATH.name)
+    payment_rows(rows, dims, chunk_rows, seed).sink_parquet(out / PAYMENT_INFO.name)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic PRA dataset.")
+    parser.add_argument('--out', type=Path, required=True, help="Output directory")
+    parser.add_argument('--rows', type=lambda value: int(value.replace('_', '')), default=1_000_000)
+    parser.add_argument('--hospitals', type=int, default=6_000)
+    parser.add_argument('--hcpcs', type=int, default=1_200)
+    parser.add_argument('--products', type=int, default=20_000)
+    parser.add_argument('--chunk-rows', type=int, default=2_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    generate(args.out, args.rows, args.hospitals, args.hcpcs, args.products, args.chunk_rows, args.seed)
+    print(f"wrote {args.rows:,} payment rows to {args.out} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Offline build steps for the PRA dataset.
+
+Run after a new db.parquet lands in DATABASE/:
+
+    python build_data.py
+
+Derived files are never rewritten in place: each build is written under a new
+content-hashed name (db_sorted.<hash>.parquet, ...), so running workers keep
+reading the files of the version they loaded. Every run ends by rewriting
+manifest.json, which lists the latest builds and a content-hashed copy of each
+source file (prices.<hash>.parquet, ...), and which running app workers pick up
+to swap in the refreshed data; builds and copies no longer listed by it or by
+the previous manifest are then removed.
+"""
+import argparse
+import hashlib
+import json
+import re
+import shutil
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+from config import *
+import polars as pl
+from polars import col as c
+from helpers import (
+    DERIVED_FILES, SOURCE_FILES, file_sha256, hcpcs_data, hospitals_data, load_parquet, load_price_data, ndc_data,
+    read_manifest, summarize_prices, unit_of_measurement_or_one, versioned_path
+)
+
+
+def publish(tmp: Path, target: Path) -> Path:
+    """
+    Move a freshly written file to the immutable, content-addressed name of its build.
+
+    Args:
+        tmp: The written file.
+        target: The configured path of the derived file.
+
+    Returns:
+        Path: The published build (see helpers.versioned_path).
+    """
+    path = versioned_path(target, file_sha256(tmp))
+    tmp.replace(path)
+    return path
+
+
+def builds(target: Path) -> List[Path]:
+    """
+    Every published build (or pinned copy) of a data file, oldest first.
+
+    Args:
+        target: The configured path of the data file.
+
+    Returns:
+        list: Paths of the builds on disk.
+    """
+    pattern = re.compile(rf'{re.escape(target.stem)}\.[0-9a-f]{{16}}{re.escape(target.suffix)}')
+    found = [path for path in target.parent.glob(f'{target.stem}.*{target.suffix}') if pattern.fullmatch(path.name)]
+    return sorted(found, key=lambda path: path.stat().st_mtime_ns)
+
+
+def latest_build(target: Path) -> Optional[Path]:
+    """The most recently published build of a derived file, or None if it has never been built."""
+    found = builds(target)
+    return found[-1] if found else None
+
+
+def build_payment_store(
+    source: Path = PAYMENT_INFO,
+    target: Path = PAYMENT_STORE,
+    row_group_size: int = PAYMENT_STORE_ROW_GROUP_SIZE,
+) -> Path:
+    """
+    Rewrite the payment data sorted by hcpcs and ndc with small row groups.
+
+    Sorting clusters every code into a contiguous run of rows, so the per-row-group
+    min/max statistics are tight and a `hcpcs ==` or `ndc.is_in(...)` predicate
+    only reads the row groups holding that code.
+
+    Args:
+        source: Path to the raw payment parquet file.
+        target: Path of the sorted payment store.
+        row_group_size: Rows per parquet row group.
+
+    Returns:
+        Path: The published build of the payment store.
+    """
+    tmp = target.with_suffix('.tmp')
+    (
+        pl.scan_parquet(source)
+        .sort(['hcpcs', 'ndc'], nulls_last=True)
+        .sink_parquet(tmp, row_group_size=row_group_size, statistics=True)
+    )
+    return publish(tmp, target)
+
+
+def _code_aggregates(payments: pl.LazyFrame, code_type: str) -> pl.LazyFrame:
+    negotiated = c.standard_charge_negotiated_dollar
+    return (
+        payments
+        .filter(c(code_type).is_not_null())
+        .group_by(c(code_type).alias('code'), c.hospital_unique_id, c.drug_type_of_measurement)
+        .agg(
+            pl.len().alias('row_count'),
+            negotiated.count().alias('negotiated_count'),
+            negotiated.sum().alias('negotiated_sum'),
+            negotiated.mean().alias('negotiated_mean'),
+            negotiated.min().alias('negotiated_min'),
+            negotiated.max().alias('negotiated_max'),
+            negotiated.quantile(0.25).alias('negotiated_q25'),
+            negotiated.median().alias('negotiated_median'),
+            negotiated.quantile(0.75).alias('negotiated_q75'),
+            c.drug_unit_of_measurement.sum().alias('unit_sum'),
+        )
+        .select(pl.lit(code_type).alias('code_type'), pl.all())
+    )
+
+
+def build_chart_aggregates(
+    source: Path = PAYMENT_INFO,
+    target: Path = CHART_AGGREGATES,
+) -> Path:
+    """
+    Precompute the per (code, hospital, drug type of measurement) stats behind the charts.
+
+    Every HCPCS code and every NDC gets its own rows (code_type 'hcpcs' or 'ndc') with the
+    row count, negotiated price count/sum/mean/min/max/quartiles and the unit-of-measurement
+    sum, so unfiltered chart requests never touch the raw payment rows.
+
+    Args:
+        source: Path to the raw payment parquet file.
+        target: Path of the aggregate table.
+
+    Returns:
+        Path: The published build of the aggregate table.
+    """
+    payments = load_parquet(source).with_columns(unit_of_measurement_or_one())
+    tmp = target.with_suffix('.tmp')
+    (
+        pl.concat([_code_aggregates(payments, 'hcpcs'), _code_aggregates(payments, 'ndc')])
+        .sort(['code_type', 'code'])
+        .collect(engine='streaming')
+        .write_parquet(tmp, row_group_size=PAYMENT_STORE_ROW_GROUP_SIZE, statistics=True)
+    )
+    return publish(tmp, target)
+
+
+def build_dimensions() -> Path:
+    """
+    Write the dimension tables as uncompressed Arrow IPC files for the app to memory-map.
+
+    The NDC and HCPCS names and the hospital table (with the 340B flag joined and dates
+    parsed) are written as the app uses them, so startup maps them without decoding
+    parquet and every worker shares the same pages through the page cache.
+
+    Returns:
+        Path: The published build of the hospital dimension.
+    """
+    dimensions = {NDC_NAMES_IPC: ndc_data, HCPCS_DESC_IPC: hcpcs_data, HOSPITAL_DIM_IPC: hospitals_data}
+    published = {}
+    for target, frame in dimensions.items():
+        tmp = target.with_suffix('.tmp')
+        frame.collect().write_ipc(tmp, compression='uncompressed')
+        published[target] = publish(tmp, target)
+    return published[HOSPITAL_DIM_IPC]
+
+
+def build_price_summaries(
+    source: Path = PRICE_PATH,
+    target: Path = PRICE_SUMMARIES_IPC,
+) -> Path:
+    """
+    Write the price panel rows of every product and HCPCS code as an uncompressed Arrow IPC file.
+
+    The background jobs memory-map it and take their selection's rows, rather than
+    scanning and summarizing the price data for every selection.
+
+    Args:
+        source: Path to the price parquet file.
+        target: Path of the price summaries.
+
+    Returns:
+        Path: The published build of the price summaries.
+    """
+    tmp = target.with_suffix('.tmp')
+    summarize_prices(load_price_data(source)).write_ipc(tmp, compression='uncompressed')
+    return publish(tmp, target)
+
+
+def pin_source(source: Path) -> Path:
+    """
+    Copy a source file to the immutable, content-addressed name of its current contents.
+
+    The app reads the copy, so a source replaced for the next refresh is never read by
+    workers still on the current version. The copy keeps the source's modification
+    time, which the app compares with the derived files built from it.
+
+    Args:
+        source: The configured path of the source file.
+
+    Returns:
+        Path: The pinned copy (see helpers.versioned_path); reused if it already exists.
+    """
+    path = versioned_path(source, file_sha256(source))
+    if not path.exists():
+        tmp = path.with_suffix('.tmp')
+        shutil.copy2(source, tmp)
+        tmp.replace(path)
+    return path
+
+
+def write_manifest(target: Path = MANIFEST_PATH) -> Path:
+    """
+    Record the SHA-256 and size of every data file, and a dataset version derived from them.
+
+    Source files are pinned (see pin_source) and listed under their own name with the
+    path of their copy; derived files are listed under their configured name with the
+    path of their latest build. Running app workers poll the manifest and swap in the
+    new dataset once all the listed files are in place, so it is written last, after
+    the data files. Builds and copies listed by neither this manifest nor the previous
+    one are removed afterwards; workers still on the previous version keep its files
+    until they have swapped.
+
+    Returns:
+        Path: The written manifest.
+    """
+    previous = read_manifest()
+    paths = {source.name: pin_source(source) for source in SOURCE_FILES if source.exists()}
+    for derived in DERIVED_FILES:
+        build = latest_build(derived)
+        if build is not None:
+            paths[derived.name] = build
+    files = {
+        name: {'path': path.name, 'sha256': file_sha256(path), 'size': path.stat().st_size}
+        for name, path in paths.items()
+    }
+    digest = hashlib.sha256()
+    for name, entry in sorted(files.items()):
+        digest.update(f"{name}:{entry['sha256']}\n".encode())
+    manifest = {
+        'version': digest.hexdigest()[:16],
+        'built': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'files': files,
+    }
+    tmp = target.with_suffix('.tmp')
+    tmp.write_text(json.dumps(manifest, indent=2))
+    tmp.replace(target)
+
+    listed = {
+        entry.get('path', name)
+        for listing in (manifest, previous) if listing
+        for name, entry in listing['files'].items()
+    }
+    for data_file in SOURCE_FILES + DERIVED_FILES:
+        for build in builds(data_file):
+            if build.name not in listed:
+                build.unlink(missing_ok=True)
+    return target
+
+
+BUILD_STEPS = {
+    'payment-store': build_payment_store,
+    'chart-aggregates': build_chart_aggregates,
+    'dimensions': build_dimensions,
+    'price-summaries': build_price_summaries,
+    'manifest': write_manifest,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build derived PRA data files.")
+    parser.add_argument('steps', nargs='*', help=f"Steps to run: {', '.join(BUILD_STEPS)} (default: all)")
+    args = parser.parse_args()
+    unknown = set(args.steps) - set(BUILD_STEPS)
+    if unknown:
+        parser.error(f"unknown step(s): {', '.join(sorted(unknown))}")
+
+    steps = list(args.steps or BUILD_STEPS)
+    # the manifest describes the files as built, so it is always (re)written last
+    if 'manifest' in steps:
+        steps.remove('manifest')
+    steps.append('manifest')
+    for name in steps:
+        start = time.perf_counter()
+        path = BUILD_STEPS[name]()
+        print(f"{name}: wrote {path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
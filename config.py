@@ -1,7 +1,10 @@
+import os
+import tempfile
 from pathlib import Path
 
 
-BASE_DIR =Path('DATABASE')
+# PRA_DATA_DIR points the app (or a benchmark run) at another copy of the data
+BASE_DIR =Path(os.environ.get('PRA_DATA_DIR', 'DATABASE'))
 PAYMENT_INFO = BASE_DIR / "db.parquet"
 NDC_NAMES = BASE_DIR / "ndc_names.parquet"
 HCPCS_DESC = BASE_DIR / "hcpcs_desc.parquet"
@@ -9,6 +12,81 @@ HOSPITALS = BASE_DIR / "hospital.parquet"
 PRICE_PATH = BASE_DIR / 'prices.parquet'
 HOSPITAL340B = BASE_DIR / 'hospital340B.parquet'
 
+# files derived by build_data.py; each build is written next to the configured name with its
+# content hash inserted (db_sorted.<hash>.parquet) and the manifest names the current one
+# hcpcs/ndc-sorted copy of PAYMENT_INFO
+PAYMENT_STORE = BASE_DIR / "db_sorted.parquet"
+PAYMENT_STORE_ROW_GROUP_SIZE = 50_000
+# per (code, hospital, drug type of measurement) stats written by build_data.py
+CHART_AGGREGATES = BASE_DIR / "chart_aggregates.parquet"
+# uncompressed Arrow IPC copies of the dimension tables written by build_data.py, memory-mapped at startup
+NDC_NAMES_IPC = BASE_DIR / "ndc_names.arrow"
+HCPCS_DESC_IPC = BASE_DIR / "hcpcs_desc.arrow"
+HOSPITAL_DIM_IPC = BASE_DIR / "hospital_dim.arrow"
+# price panel rows of every product and HCPCS code, memory-mapped by the background jobs
+PRICE_SUMMARIES_IPC = BASE_DIR / "price_summaries.arrow"
+# content hashes of the data files, written by build_data.py; its version is part of every cache key
+MANIFEST_PATH = BASE_DIR / "manifest.json"
+# seconds between checks for a refreshed dataset to swap in (0 disables hot reload)
+RELOAD_INTERVAL_SECONDS = float(os.environ.get('PRA_RELOAD_INTERVAL', 60))
 
+# memory bound for the per-selection result cache in helpers.py
+RESULT_CACHE_MAX_BYTES = 512 * 1024 ** 2
 
-    
\ No newline at end of file
+# number of options returned by the selection dropdown typeahead search
+SEARCH_RESULT_LIMIT = 50
+# memory bound for the per-session filtered grid frames shared by the chart callbacks
+SESSION_FRAME_CACHE_MAX_BYTES = 256 * 1024 ** 2
+# number of browser sessions whose latest grid request is tracked to cancel superseded queries
+SESSION_REQUESTS_MAX = 10_000
+# price distribution charts with more points than this are sent as precomputed box statistics
+DISTRIBUTION_MAX_POINTS = 5_000
+# outliers drawn per precomputed box (evenly spaced through the sorted outliers, the extremes always kept)
+DISTRIBUTION_OUTLIER_SAMPLE = 200
+# selections with more hospitals than this are mapped with WebGL (scattermap) instead of SVG (scattergeo)
+MAP_MAX_SVG_POINTS = 1_000
+# basemap of the WebGL map, a plotly tile style loaded by the browser from its provider (CARTO for
+# 'carto-positron'); 'white-bg' needs no tile server but draws the markers without any land or borders
+MAP_STYLE = os.environ.get('PRA_MAP_STYLE', 'carto-positron')
+
+# queries slower than this (seconds) are reported; with PRA_LOG_QUERY_PLANS=1 their Polars plan is printed too
+SLOW_QUERY_SECONDS = float(os.environ.get('PRA_SLOW_QUERY_SECONDS', 1.0))
+LOG_SLOW_QUERY_PLANS = os.environ.get('PRA_LOG_QUERY_PLANS') == '1'
+
+# responses smaller than this (bytes) are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+
+# gunicorn.conf.py imports the app in the master before forking. Polars deadlocks in a forked
+# child once its thread pool has started, so there the in-memory datasets are built per
+# worker (helpers.load_datasets in post_fork) instead of at import
+LOAD_DATA_ON_IMPORT = os.environ.get('PRA_DEFER_DATA_LOAD') != '1'
+
+# Polars settings, exported to the environment here because Polars reads them when it is
+# imported: import config before polars in every entry point (app.py, build_data.py)
+# threads in each process's Polars pool (unset: one per core)
+POLARS_MAX_THREADS = os.environ.get('PRA_POLARS_MAX_THREADS')
+# rows per chunk in the streaming engine (unset: chosen by Polars from the schema and pool size)
+STREAMING_CHUNK_SIZE = os.environ.get('PRA_STREAMING_CHUNK_SIZE')
+if POLARS_MAX_THREADS:
+    os.environ['POLARS_MAX_THREADS'] = POLARS_MAX_THREADS
+if STREAMING_CHUNK_SIZE:
+    os.environ['POLARS_IDEAL_MORSEL_SIZE'] = STREAMING_CHUNK_SIZE
+
+# heavy queries (selection scans, grid filters, aggregations, exports) run at once per process;
+# others wait up to QUERY_SLOT_TIMEOUT seconds for a slot
+MAX_CONCURRENT_QUERIES = int(os.environ.get('PRA_MAX_CONCURRENT_QUERIES', 2))
+QUERY_SLOT_TIMEOUT = float(os.environ.get('PRA_QUERY_SLOT_TIMEOUT', 30))
+
+# Dash background callback results and the selection frames the background jobs hand to the
+# web workers (uncompressed Arrow IPC)
+CACHE_DIR = Path(os.environ.get('PRA_CACHE_DIR', Path(tempfile.gettempdir()) / 'pra_cache'))
+BACKGROUND_CACHE_DIR = CACHE_DIR / 'background'
+SPILL_DIR = CACHE_DIR / 'selections'
+# metric totals shared by the web workers and the background job processes
+METRICS_DIR = Path(os.environ.get('PRA_METRICS_DIR', CACHE_DIR / 'metrics'))
+# seconds between each web process adding its metrics to the totals (0 flushes only at scrape and exit)
+METRICS_FLUSH_SECONDS = float(os.environ.get('PRA_METRICS_FLUSH_INTERVAL', 10))
+# seconds a background callback result is reused for the same inputs
+BACKGROUND_CACHE_EXPIRE = 3600
+# disk bound for the spilled selection frames, oldest removed first
+SPILL_MAX_BYTES = 4 * 1024 ** 3
@@ -1,3 +1,5 @@
+import polars as pl
+
     
 data_dict_schema = [
         {"column": "description", "dtype": "str", "desc": "Description of the drug or service"},
@@ -22,4 +24,36 @@ data_dict_schema = [
         {"column": "beds", "dtype": "int", "desc": "Number of hospital beds"},
         {"column": "lat", "dtype": "float", "desc": "Latitude of hospital"},
         {"column": "long", "dtype": "float", "desc": "Longitude of hospital"},
-    ]
\ No newline at end of file
+    ]
+
+def schema_for_fig_data():
+    """
+    Define the schema for the DataFrame used in the visualization.
+    
+    Returns:
+        dict: A dictionary defining the schema for the DataFrame.
+    """
+    return {
+        'description': pl.String,   
+        'ndc': pl.String,
+        'hcpcs': pl.String,
+        'setting': pl.String,
+        'drug_unit_of_measurement': pl.Int64,
+        'drug_type_of_measurement': pl.String,
+        'payer_name': pl.String,
+        'plan_name': pl.String,
+        'standard_charge_gross': pl.Float64,
+        'standard_charge_discounted_cash': pl.Float64,
+        'standard_charge_negotiated_dollar': pl.Float64,
+        'standard_charge_methodology': pl.String,
+        'standard_charge_negotiated_percentage': pl.Float64,
+        'calculated_negotiated_dollars': pl.Boolean,
+        'hospital_unique_id': pl.String,
+        'mapped_plan_name': pl.String,
+        'mapped_lob_name': pl.String,
+        'name': pl.String,
+        'state': pl.String,
+        'beds': pl.Int32,
+        'lat': pl.Float64,
+        'long': pl.Float64
+    }
@@ -0,0 +1,54 @@
+"""
+Gunicorn settings for the production server:
+
+    gunicorn -c gunicorn.conf.py wsgi:server
+
+The app is imported once in the master (preload_app) so the imported modules, the
+layout and the warm parquet pages are shared copy-on-write by the workers. Polars
+must not run in the master (a forked child hangs on its first parallel query once
+the parent's thread pool has started), so the in-memory datasets are built per
+worker in post_fork.
+"""
+import gc
+import multiprocessing
+import os
+
+# read by config when the app is preloaded below
+os.environ.setdefault('PRA_DEFER_DATA_LOAD', '1')
+
+cores = multiprocessing.cpu_count()
+
+bind = os.environ.get('PRA_BIND', '0.0.0.0:8050')
+preload_app = True
+# a few processes, each running several requests on threads: Polars releases the GIL
+# while a query runs, so one worker's threads share its Polars pool
+workers = int(os.environ.get('PRA_WORKERS', max(2, cores // 4)))
+worker_class = 'gthread'
+threads = int(os.environ.get('PRA_THREADS', 4))
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# split the cores between the workers' Polars pools instead of one pool per core in
+# every worker (config exports it as POLARS_MAX_THREADS before polars is imported)
+os.environ.setdefault('PRA_POLARS_MAX_THREADS', str(max(1, cores // workers)))
+
+
+def on_starting(server):
+    # the metric totals are shared by the workers; start them from zero like the workers
+    import instrumentation
+    instrumentation.metrics.reset()
+
+
+def pre_fork(server, worker):
+    # keep the preloaded objects out of the collector so it does not dirty their pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import helpers
+    import instrumentation
+    helpers.load_datasets()
+    # threads do not survive the fork, so each worker runs its own reloader and metrics flusher
+    helpers.start_reloader()
+    instrumentation.start_flusher()
@@ -1,13 +1,28 @@
-import polars as pl
+import json
+import os
+import hashlib
+import time
 from config import *
+import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.ipc as pa_ipc
 from pathlib import Path
+from datetime import datetime
+from threading import BoundedSemaphore, Lock, Thread, get_ident, local
+from contextlib import contextmanager
+from functools import cached_property
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
 from polars import col as c
 import plotly.express as px
 import polars.selectors as cs
-from dash import dash_table, html
-from typing import Dict, List, Union
+from dash import Patch, dash_table, html
+from typing import Callable, Dict, Hashable, List, Optional
 import dash_mantine_components as dmc
 from data_dictionary_table_schema import data_dict_schema
+from ag_grid_def import columnDefs
+from instrumentation import collect, metrics, stage, timed
 import dash_mantine_components as dmc
 
 def load_parquet(path: Path) -> pl.LazyFrame:
@@ -22,48 +37,132 @@ def load_parquet(path: Path) -> pl.LazyFrame:
     """
     return pl.scan_parquet(path)
 
+def read_ipc_mapped(path: Path) -> pl.DataFrame:
+    """
+    Memory-map an uncompressed Arrow IPC file as a DataFrame without copying it.
+
+    The columns point into the mapped file, so the pages are shared through the
+    page cache by every process that maps it. Polars' `read_ipc` copies the file
+    into memory, so the file is mapped with pyarrow instead.
+
+    Args:
+        path (Path): The Arrow IPC file.
+
+    Returns:
+        pl.DataFrame: The memory-mapped frame.
+    """
+    table = pa_ipc.open_file(pa.memory_map(str(path))).read_all()
+    return pl.from_arrow(table, rechunk=False)
+
+def load_dimension(frame: pl.LazyFrame, ipc_path: Optional[Path], *sources: Path) -> pl.DataFrame:
+    """
+    Collect a dimension table, memory-mapping the Arrow IPC copy written by build_data.py when it is current.
+
+    Args:
+        frame (pl.LazyFrame): The dimension as built from its parquet sources.
+        ipc_path (Path, optional): Its Arrow IPC copy, if one was built.
+        *sources (Path): Parquet files the copy was built from; a copy older than any of them is ignored.
+
+    Returns:
+        pl.DataFrame: The dimension table.
+    """
+    if ipc_path is None:
+        return frame.collect()
+    try:
+        built = ipc_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return frame.collect()
+    if any(source.stat().st_mtime_ns > built for source in sources):
+        return frame.collect()
+    return read_ipc_mapped(ipc_path)
+
 def to_date_format():
     return cs.contains("retrieved").str.to_date("%Y-%m-%dT%H:%M:%S%.3fZ")
 
-payment_info = (
-    load_parquet(PAYMENT_INFO)
-    .with_columns(pl.when(c.drug_unit_of_measurement.is_null() | (c.drug_unit_of_measurement == 0))
-                .then(1.0)
-                .otherwise(c.drug_unit_of_measurement)
-                .alias('drug_unit_of_measurement'))
-)
-ndc_data = load_parquet(NDC_NAMES)
-# J8499 is blacket non chemo drug - remove from selection option
-hcpcs_data = load_parquet(HCPCS_DESC).filter(~c.hcpcs.is_in(['J8499']))
-hospitals_data = load_parquet(HOSPITALS).with_columns(
-    pl.col(['lat','long']).cast(pl.Float64),
-    to_date_format()
-)
+def unit_of_measurement_or_one() -> pl.Expr:
+    """Drug unit of measurement with null or 0 replaced by 1.0."""
+    return (
+        pl.when(c.drug_unit_of_measurement.is_null() | (c.drug_unit_of_measurement == 0))
+        .then(1.0)
+        .otherwise(c.drug_unit_of_measurement)
+        .alias('drug_unit_of_measurement')
+    )
 
-hospital340B = load_parquet(HOSPITAL340B)
+def load_hcpcs_data(path: Path = HCPCS_DESC) -> pl.LazyFrame:
+    """Scan the HCPCS names, without the codes left out of the selection options."""
+    # J8499 is blacket non chemo drug - remove from selection option
+    return load_parquet(path).filter(~c.hcpcs.is_in(['J8499']))
+
+def load_hospitals_data(path: Path = HOSPITALS, hospital340b_path: Path = HOSPITAL340B) -> pl.LazyFrame:
+    """Scan the hospitals with coordinates cast, dates parsed and the 340B flag joined."""
+    hospitals = load_parquet(path).with_columns(
+        pl.col(['lat','long']).cast(pl.Float64),
+        to_date_format()
+    )
+    return add_340b_info(hospitals, load_parquet(hospital340b_path))
 
 # function to add 340b flag to lazyframe on hospital unique_id
-def add_340b_info(df: pl.LazyFrame) -> pl.LazyFrame:
+def add_340b_info(df: pl.LazyFrame, hospital340b: Optional[pl.LazyFrame] = None) -> pl.LazyFrame:
     """
     Add a 340B flag to the hospital data based on the hospital340B dataset.
     
     Args:
         df: Input LazyFrame containing hospital data
+        hospital340b: The 340B hospitals; defaults to hospital340B.parquet
     
     Returns:
         LazyFrame with an additional 'is_340b' column
     """
+    if hospital340b is None:
+        hospital340b = hospital340B
     # get list of 340B hospitals
     return (
         df
-        .join(hospital340B.select(c.unique_id, c.program_type_long), on='unique_id', how='left')
+        .join(hospital340b.select(c.unique_id, c.program_type_long), on='unique_id', how='left')
         .with_columns(c.program_type_long.is_not_null().alias('is_340b'))
     )
 
+ndc_data = load_parquet(NDC_NAMES)
+hcpcs_data = load_hcpcs_data()
+hospital340B = load_parquet(HOSPITAL340B)
+# hospitals with the 340b flag
+hospitals_data = load_hospitals_data()
+
+def build_hospital_dim(ipc_path: Optional[Path] = None, hospitals_path: Optional[Path] = None,
+                       hospital340b_path: Optional[Path] = None) -> pl.DataFrame:
+    """
+    Collect the hospital attributes once, with the 340B flag joined and dates parsed.
+
+    Payment rows only carry hospital_unique_id, so every request joins this small
+    in-memory table instead of re-reading hospital.parquet, re-joining hospital340B
+    and re-parsing the retrieved dates.
+
+    Args:
+        ipc_path (Path, optional): Memory-mapped copy written by build_data.py, used when it is current.
+        hospitals_path (Path, optional): The hospital file to read otherwise; defaults to HOSPITALS.
+        hospital340b_path (Path, optional): The 340B file to read otherwise; defaults to HOSPITAL340B.
+
+    Returns:
+        pl.DataFrame: One row per hospital.
+    """
+    hospitals_path = hospitals_path or HOSPITALS
+    hospital340b_path = hospital340b_path or HOSPITAL340B
+    return load_dimension(
+        load_hospitals_data(hospitals_path, hospital340b_path), ipc_path, hospitals_path, hospital340b_path
+    )
+
+@timed()
+def get_hospital_info(hospital_id: str) -> dict:
+    """
+    Get all attributes of a hospital.
 
+    Args:
+        hospital_id (str): The hospital unique_id.
 
-# add 340b flag to hospitals_data
-hospitals_data = add_340b_info(hospitals_data)
+    Returns:
+        dict: Column name to list of values (empty lists if the hospital is unknown).
+    """
+    return dataset.hospital_dim.filter(c.unique_id == hospital_id).to_dict(as_series=False)
 
 money_col = [
     'standard_charge_discounted_cash',
@@ -71,23 +170,421 @@ money_col = [
     'standard_charge_gross'
 ]
 
-def get_hcpcs_desc_list() -> list:
+def file_version(*paths: Path) -> str:
     """
-    Get a list of unique HCPCS descriptions.
-    
+    Identify the current state of a set of data files.
+
+    Args:
+        *paths (Path): The files to fingerprint; missing files are skipped.
+
     Returns:
-        list: A list of unique HCPCS descriptions.
+        str: Token derived from the files' modification times and sizes.
     """
-    return hcpcs_data.select(c("hcpcs_desc")).unique().sort('hcpcs_desc').collect().to_series().to_list()
+    stats = [path.stat() for path in paths if path.exists()]
+    return '-'.join(f'{stat.st_mtime_ns:x}.{stat.st_size:x}' for stat in stats)
+
+# files the data is delivered as; build_data.py pins each one as an immutable copy (see versioned_path)
+# that the manifest lists under the file's own name
+SOURCE_FILES = [PAYMENT_INFO, PRICE_PATH, NDC_NAMES, HCPCS_DESC, HOSPITALS, HOSPITAL340B]
+# files written by build_data.py; each build writes a new immutable copy (see versioned_path)
+# and the manifest lists it under the name configured here
+DERIVED_FILES = [PAYMENT_STORE, CHART_AGGREGATES, NDC_NAMES_IPC, HCPCS_DESC_IPC, HOSPITAL_DIM_IPC, PRICE_SUMMARIES_IPC]
 
-def get_product_list() -> list:
+def versioned_path(path: Path, sha256: str) -> Path:
     """
-    Get a list of unique product names.
-    
+    Name of one build of a data file: the content hash goes before the suffix.
+
+    A build never rewrites the file a running worker may be reading, e.g.
+    db_sorted.parquet is written as db_sorted.<hash>.parquet, and prices.parquet
+    is pinned as prices.<hash>.parquet.
+
+    Args:
+        path (Path): The configured path of the data file.
+        sha256 (str): Hex SHA-256 of the file's contents.
+
+    Returns:
+        Path: The path of this build of the file.
+    """
+    return path.with_name(f'{path.stem}.{sha256[:16]}{path.suffix}')
+
+def file_sha256(path: Path) -> str:
+    """SHA-256 of a file's contents, read in 1 MiB chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 ** 2), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_manifest() -> Optional[dict]:
+    """
+    Read the dataset manifest written by build_data.py.
+
+    Returns:
+        dict: {'version', 'files': {name: {'path', 'sha256', 'size'}}}, or None if there is none.
+    """
+    try:
+        return json.loads(MANIFEST_PATH.read_text())
+    except FileNotFoundError:
+        return None
+
+def manifest_version(manifest: Optional[dict]) -> Optional[str]:
+    """
+    Version of the data files a manifest describes, if they are all on disk.
+
+    This is the manifest's content-hash version, provided every file it lists is
+    present with the recorded size; while a refresh is still being copied in the
+    files do not match and None is returned. Without a manifest the source files'
+    modification times and sizes are used.
+
+    Args:
+        manifest (dict): As returned by read_manifest.
+
+    Returns:
+        str: The version, or None if the files do not match the manifest.
+    """
+    if manifest is None:
+        return file_version(*SOURCE_FILES)
+    for name, entry in manifest['files'].items():
+        path = BASE_DIR / entry.get('path', name)
+        if not path.exists() or path.stat().st_size != entry['size']:
+            return None
+    return manifest['version']
+
+def current_version() -> Optional[str]:
+    """Version of the data files currently on disk (see manifest_version)."""
+    return manifest_version(read_manifest())
+
+def dataset_files(manifest: Optional[dict]) -> Dict[str, Path]:
+    """
+    Resolve the files of the dataset a manifest describes.
+
+    Args:
+        manifest (dict): As returned by read_manifest; without one only the source files are used.
+
+    Returns:
+        dict: Configured file name (e.g. 'db_sorted.parquet') to the path of the listed
+              build of that file, for the files present on disk.
+    """
+    files = {path.name: path for path in SOURCE_FILES}
+    for name, entry in (manifest or {}).get('files', {}).items():
+        files[name] = BASE_DIR / entry.get('path', name)
+    return {name: path for name, path in files.items() if path.exists()}
+
+class OptionSearch:
+    """
+    Typeahead search over a sorted list of dropdown options.
+
+    Prefix matches come from a binary search over the lower-cased options and are
+    ranked first; substring matches come from a trigram index, so neither scans the
+    whole catalog. Queries shorter than a trigram only match prefixes.
+
+    Args:
+        options (list): The sorted option labels.
+    """
+
+    def __init__(self, options: List[str]):
+        self.options = options
+        self._lower = [option.lower() for option in options]
+        prefix_order = sorted(range(len(options)), key=self._lower.__getitem__)
+        self._prefix_keys = [self._lower[i] for i in prefix_order]
+        self._prefix_ids = prefix_order
+
+        trigrams = defaultdict(list)
+        for i, key in enumerate(self._lower):
+            for gram in {key[j:j + 3] for j in range(len(key) - 2)}:
+                trigrams[gram].append(i)
+        self._trigrams = dict(trigrams)
+
+    def _substring_candidates(self, query: str):
+        # too short for the trigram index; such queries only match prefixes
+        if len(query) < 3:
+            return []
+        postings = sorted(
+            (self._trigrams.get(query[j:j + 3], []) for j in range(len(query) - 2)),
+            key=len
+        )
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+        return sorted(candidates)
+
+    def search(self, query: str, limit: int = SEARCH_RESULT_LIMIT) -> List[str]:
+        """
+        Find the options matching a typed query.
+
+        Args:
+            query (str): Prefix or substring to search for (case-insensitive).
+            limit (int): Maximum number of options to return.
+
+        Returns:
+            list: Matching options, prefix matches first.
+        """
+        query = query.strip().lower()
+        if not query:
+            return self.options[:limit]
+
+        matches = []
+        start = bisect_left(self._prefix_keys, query)
+        for key, i in zip(self._prefix_keys[start:], self._prefix_ids[start:]):
+            if len(matches) >= limit or not key.startswith(query):
+                break
+            matches.append(i)
+
+        if len(matches) < limit:
+            prefix_matches = set(matches)
+            for i in self._substring_candidates(query):
+                if i not in prefix_matches and query in self._lower[i]:
+                    matches.append(i)
+                    if len(matches) >= limit:
+                        break
+
+        return [self.options[i] for i in matches]
+
+class LookupIndex:
+    """
+    In-memory code lookups and dropdown option lists built once from the HCPCS and NDC name files.
+
+    The option lists and their search index are built on first use: background jobs
+    only look up codes.
+
+    Args:
+        hcpcs (pl.DataFrame): Frame with 'hcpcs_desc' and 'hcpcs' columns.
+        ndc (pl.DataFrame): Frame with 'product' and 'ndc' columns.
+        version (str): Version of the name files the index was built from.
+    """
+
+    def __init__(self, hcpcs: pl.DataFrame, ndc: pl.DataFrame, version: str = ''):
+        self.version = version
+        self.hcpcs_by_desc: Dict[str, str] = dict(zip(hcpcs['hcpcs_desc'], hcpcs['hcpcs']))
+        ndcs = ndc.group_by('product').agg(c.ndc)
+        self.ndcs_by_product: Dict[str, List[str]] = dict(zip(ndcs['product'], ndcs['ndc'].to_list()))
+
+    @cached_property
+    def options(self) -> Dict[str, List[str]]:
+        """Sorted dropdown options of each kind ('hcpcs', 'product')."""
+        return {'hcpcs': sorted(self.hcpcs_by_desc), 'product': sorted(self.ndcs_by_product)}
+
+    @cached_property
+    def options_json(self) -> Dict[str, bytes]:
+        """The options pre-serialized for the /options/<kind>.json route."""
+        return {kind: json.dumps(options).encode() for kind, options in self.options.items()}
+
+    @cached_property
+    def search(self) -> Dict[str, OptionSearch]:
+        """Typeahead search over the options of each kind."""
+        return {kind: OptionSearch(options) for kind, options in self.options.items()}
+
+    def hcpcs_code(self, hcpcs_desc: str) -> str:
+        """HCPCS code of a description."""
+        return self.hcpcs_by_desc[hcpcs_desc]
+
+    def ndc_codes(self, product: str) -> List[str]:
+        """NDC codes of a product (empty if it is unknown)."""
+        return self.ndcs_by_product.get(product, [])
+
+def build_lookup_index(hcpcs_ipc: Optional[Path] = None, ndc_ipc: Optional[Path] = None,
+                       version: str = '', hcpcs_path: Optional[Path] = None,
+                       ndc_path: Optional[Path] = None) -> LookupIndex:
+    """
+    Read the HCPCS and NDC name files (or their memory-mapped copies) into a LookupIndex.
+
+    Args:
+        hcpcs_ipc (Path, optional): Memory-mapped copy of the HCPCS names written by build_data.py.
+        ndc_ipc (Path, optional): Memory-mapped copy of the NDC names written by build_data.py.
+        version (str): Version of the name files.
+        hcpcs_path (Path, optional): The HCPCS names file to read otherwise; defaults to HCPCS_DESC.
+        ndc_path (Path, optional): The NDC names file to read otherwise; defaults to NDC_NAMES.
+
+    Returns:
+        LookupIndex: The freshly built index.
+    """
+    hcpcs_path = hcpcs_path or HCPCS_DESC
+    ndc_path = ndc_path or NDC_NAMES
+    hcpcs = load_dimension(load_hcpcs_data(hcpcs_path), hcpcs_ipc, hcpcs_path).select(c.hcpcs_desc, c.hcpcs).drop_nulls()
+    ndc = load_dimension(load_parquet(ndc_path), ndc_ipc, ndc_path).select(c.product, c.ndc).drop_nulls()
+    return LookupIndex(hcpcs, ndc, version)
+
+class DatasetSnapshot:
+    """
+    One version of the dataset: the payment data scan and the in-memory dimensions built from it.
+
+    Requests read a snapshot once and use its parts together, so a refresh swapped in
+    mid-request never mixes the old and new versions of the data. The files a snapshot
+    reads are the builds listed in its manifest, which build_data.py never rewrites,
+    so a snapshot stays readable while a newer one is being built.
+
+    The in-memory parts are built on first use, so a background job only pays for the
+    parts its selection needs; the web workers build them all up front with `load`.
+
+    Args:
+        version (str): Dataset version, part of every cache key.
+        files (dict): Configured file name to the path of this version's file (see dataset_files).
+    """
+
+    def __init__(self, version: str, files: Dict[str, Path]):
+        self.version = version
+        self.files = files
+        # the hcpcs/ndc-sorted store, whose row-group statistics let a single-code filter skip
+        # every other row group, or the raw db.parquet when the store has not been built
+        self.payment_path = self.file(PAYMENT_STORE) or self.file(PAYMENT_INFO)
+        self.payment_info = load_parquet(self.payment_path).with_columns(unit_of_measurement_or_one())
+        # precomputed chart stats, unless missing or older than the payment data
+        self.chart_aggregates = self.file(CHART_AGGREGATES)
+        if self.chart_aggregates and self.chart_aggregates.stat().st_mtime_ns < self.payment_path.stat().st_mtime_ns:
+            self.chart_aggregates = None
+        # precomputed price panel rows, unless missing or older than the price data
+        self.price_summaries_path = self.file(PRICE_SUMMARIES_IPC)
+        prices = self.file(PRICE_PATH)
+        if self.price_summaries_path and prices and self.price_summaries_path.stat().st_mtime_ns < prices.stat().st_mtime_ns:
+            self.price_summaries_path = None
+
+    def file(self, path: Path) -> Optional[Path]:
+        """This version's build of a configured data file, or None if it is not part of it."""
+        return self.files.get(path.name)
+
+    @cached_property
+    def hospital_dim(self) -> pl.DataFrame:
+        """The hospital dimension."""
+        return build_hospital_dim(self.file(HOSPITAL_DIM_IPC), self.file(HOSPITALS), self.file(HOSPITAL340B))
+
+    @cached_property
+    def lookup_index(self) -> LookupIndex:
+        """Code lookups and dropdown options."""
+        return build_lookup_index(
+            self.file(HCPCS_DESC_IPC), self.file(NDC_NAMES_IPC), self.version, self.file(HCPCS_DESC), self.file(NDC_NAMES)
+        )
+
+    @cached_property
+    def price_summaries(self) -> 'PriceSummaries':
+        """Price panel data of every product and HCPCS code."""
+        if self.price_summaries_path:
+            return PriceSummaries(read_ipc_mapped(self.price_summaries_path))
+        return PriceSummaries(summarize_prices(load_price_data(self.file(PRICE_PATH))))
+
+    def selection_prices(self, how: str, value: str) -> 'PriceSummaries':
+        """
+        Price summaries covering one selection.
+
+        Uses the summaries of every selection once they are built. Otherwise (a background
+        job) only the selection's rows are taken, from the memory-mapped rows written by
+        build_data.py, or summarized from its own price rows when they have not been built.
+
+        Args:
+            how (str): Selection type ('hcpcs' or 'ndc').
+            value (str): HCPCS code or product name.
+
+        Returns:
+            PriceSummaries: Summaries holding at least the selection's prices.
+        """
+        if 'price_summaries' in self.__dict__:
+            return self.price_summaries
+        if self.price_summaries_path:
+            return PriceSummaries(read_ipc_mapped(self.price_summaries_path).filter((c.how == how) & (c.key == value)))
+        key = c.hcpcs if how == 'hcpcs' else c.product
+        return PriceSummaries(summarize_prices(load_price_data(self.file(PRICE_PATH)).filter(key == value)))
+
+    def load(self) -> 'DatasetSnapshot':
+        """Build the parts every web request may use, so no request waits for them."""
+        self.hospital_dim
+        self.lookup_index.options_json
+        self.lookup_index.search
+        return self
+
+def build_snapshot(manifest: Optional[dict] = None) -> DatasetSnapshot:
+    """
+    Load the dataset a manifest describes.
+
+    Args:
+        manifest (dict, optional): As returned by read_manifest; read from disk if not given.
+
+    Returns:
+        DatasetSnapshot: The loaded dataset.
+    """
+    if manifest is None:
+        manifest = read_manifest()
+    version = manifest_version(manifest) or file_version(*SOURCE_FILES)
+    return DatasetSnapshot(version, dataset_files(manifest))
+
+# the dataset requests are served from; replaced as a whole by install_snapshot
+dataset: Optional[DatasetSnapshot] = None
+_reload_lock = Lock()
+
+def install_snapshot(snapshot: DatasetSnapshot) -> None:
+    """
+    Make a snapshot the current dataset and drop the cached results of the previous one.
+
+    Args:
+        snapshot (DatasetSnapshot): The dataset to serve.
+    """
+    global dataset
+    dataset = snapshot
+    # entries of the old version can no longer be hit, since every key holds the version
+    for cache in (result_cache, session_frames):
+        cache.clear()
+
+def load_datasets() -> None:
+    """
+    Load the current dataset: the payment data scan, hospital dimension and lookup index.
+
+    Runs at import unless LOAD_DATA_ON_IMPORT is off, in which case each gunicorn
+    worker calls it after the fork.
+    """
+    with _reload_lock:
+        install_snapshot(build_snapshot().load())
+
+def ensure_datasets() -> None:
+    """
+    Open the dataset if this process has not yet (background jobs).
+
+    Its parts are left to be built on first use, since a job needs only a few of them.
+    """
+    if dataset is None:
+        with _reload_lock:
+            install_snapshot(build_snapshot())
+
+def reload_if_changed() -> bool:
+    """
+    Swap in the dataset on disk if its version differs from the one being served.
+
+    The new snapshot is built while requests keep using the old one, then replaces it
+    in a single assignment.
+
+    Returns:
+        bool: True if a new version was installed.
+    """
+    with _reload_lock:
+        manifest = read_manifest()
+        version = manifest_version(manifest)
+        if version is None or dataset is None or version == dataset.version:
+            return False
+        with stage('dataset_reload'):
+            install_snapshot(build_snapshot(manifest).load())
+    print(f"Loaded dataset version {version}")
+    return True
+
+def _reload_periodically(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            reload_if_changed()
+        except Exception as e:
+            print(f"Error reloading dataset: {e}")
+
+def start_reloader(interval: float = RELOAD_INTERVAL_SECONDS) -> Optional[Thread]:
+    """
+    Check for a refreshed dataset every `interval` seconds in a daemon thread.
+
+    Args:
+        interval (float): Seconds between checks; 0 disables the reloader.
+
     Returns:
-        list: A list of unique product names.
+        Thread: The reloader thread, or None if disabled.
     """
-    return ndc_data.select(c("product")).unique().sort('product').collect().to_series().to_list()
+    if interval <= 0:
+        return None
+    thread = Thread(target=_reload_periodically, args=(interval,), name='dataset-reloader', daemon=True)
+    thread.start()
+    return thread
 
 # function that accepts hcpcs_desc and returns hcpcs code
 def get_hcpcs_code(hcpcs_desc: str) -> str:
@@ -100,7 +597,7 @@ def get_hcpcs_code(hcpcs_desc: str) -> str:
     Returns:
         str: The corresponding HCPCS code.
     """
-    return hcpcs_data.filter(c("hcpcs_desc") == hcpcs_desc).select(c("hcpcs")).collect().item()
+    return dataset.lookup_index.hcpcs_code(hcpcs_desc)
 
 def get_ndc_codes(product: str) -> list:
     """
@@ -112,64 +609,751 @@ def get_ndc_codes(product: str) -> list:
     Returns:
         list: The corresponding NDC codes.
     """
-    return ndc_data.filter(c("product") == product).select(c("ndc")).collect().to_series().to_list()
+    return dataset.lookup_index.ndc_codes(product)
 
-def filter_payment_info(how: str, value: str, data: pl.LazyFrame = payment_info) -> pl.LazyFrame:
+def filter_payment_info(how: str, value: str, snapshot: Optional[DatasetSnapshot] = None) -> pl.LazyFrame:
     # check if how is in ["hcpcs", "ndc"]
     # if how not in ["hcpcs", "ndc"]:
     #     raise ValueError("how must be either 'hcpcs' or 'ndc'")
+    if snapshot is None:
+        snapshot = dataset
+    data = snapshot.payment_info
     
     if how == "hcpcs":
-        return data.filter(c("hcpcs") == get_hcpcs_code(value))
+        return data.filter(c("hcpcs") == snapshot.lookup_index.hcpcs_code(value))
     
     if how == "ndc":
-        return data.filter(c("ndc").is_in(get_ndc_codes(value)))
+        return data.filter(c("ndc").is_in(snapshot.lookup_index.ndc_codes(value)))
     
     # Fallback: return an empty LazyFrame with the same schema as data
     return data.filter(pl.lit(False))
 
 
 # add hospital data to grid
-def add_hospital_data(data: pl.LazyFrame) -> pl.LazyFrame:
+def add_hospital_data(data: pl.LazyFrame, hospital: Optional[pl.DataFrame] = None) -> pl.LazyFrame:
+    if hospital is None:
+        hospital = dataset.hospital_dim
+    # payment row order, so a block sliced from this query matches the same rows of the collected selection
     data = data.join(
-        hospitals_data.select(c.unique_id, c.name, c.state, c.beds, c.is_340b, c.lat, c.long, c.retrieved),
+        hospital.lazy().select(c.unique_id, c.name, c.state, c.beds, c.is_340b, c.lat, c.long, c.retrieved),
         left_on='hospital_unique_id',
-        right_on='unique_id'
+        right_on='unique_id',
+        maintain_order='left'
     )
     return data
 
-def create_price_distribution_plot(df):
+class FrameCache:
     """
-    Create a box plot showing price distribution by drug measurement type.
-    
+    Thread-safe LRU cache of collected Polars DataFrames bounded by their estimated size.
+
     Args:
-        df: Polars DataFrame with columns 'drug_type_of_measurement' and 'price_per_unit'
-    
+        max_bytes (int): Total estimated size of the cached frames before the least
+            recently used entries are evicted.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+
+    def get(self, key: Hashable, tag: Hashable = None) -> Optional[pl.DataFrame]:
+        """Return the cached frame for key, or None if missing or stored under another tag."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] != tag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, frame: pl.DataFrame, tag: Hashable = None) -> None:
+        """Store a frame, replacing any entry under the same key regardless of its tag."""
+        size = frame.estimated_size()
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            # a frame larger than the whole cache would only flush everything else
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (frame, size, tag)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether a frame is cached under key (not counted as a hit or miss)."""
+        with self._lock:
+            return key in self._entries
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+result_cache = FrameCache(RESULT_CACHE_MAX_BYTES)
+# latest grid-filtered frame of each browser session, keyed by session id and
+# tagged with the selection/filter state it was computed for
+session_frames = FrameCache(SESSION_FRAME_CACHE_MAX_BYTES)
+
+class SpillStore:
+    """
+    Collected frames shared between processes as uncompressed Arrow IPC files.
+
+    Background callbacks run in their own processes, so the selection frames they
+    collect are written here and read back by the web workers (and by the other
+    workers) instead of being recomputed; reading uncompressed IPC is a plain copy
+    rather than a scan.
+
+    Args:
+        directory (Path): Where the files are kept.
+        max_bytes (int): Total size of the files before the least recently written are removed.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, key: Hashable) -> Path:
+        return self.directory / f'{hashlib.sha256(repr(key).encode()).hexdigest()}.arrow'
+
+    def get(self, key: Hashable) -> Optional[pl.DataFrame]:
+        """Return the stored frame for key, or None if missing."""
+        try:
+            return pl.read_ipc(self._path(key))
+        except FileNotFoundError:
+            return None
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._path(key).exists()
+
+    def put(self, key: Hashable, frame: pl.DataFrame) -> None:
+        """Store a frame; the file is written under a temporary name and renamed into place."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp = path.with_name(f'{path.stem}.{os.getpid()}.{get_ident()}.tmp')
+        frame.write_ipc(tmp, compression='uncompressed')
+        tmp.replace(path)
+        self._prune()
+
+    def _prune(self) -> None:
+        files = []
+        for path in self.directory.glob('*.arrow'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+spill_store = SpillStore(SPILL_DIR, SPILL_MAX_BYTES)
+
+_query_slots = BoundedSemaphore(MAX_CONCURRENT_QUERIES)
+_query_slot_holder = local()
+# how often a queued request checks whether it has been superseded
+_SLOT_POLL_SECONDS = 0.05
+
+class QueryCancelled(Exception):
+    """Raised instead of running a query whose request has been superseded."""
+
+@contextmanager
+def query_slot(cancelled: Optional[Callable[[], bool]] = None):
+    """
+    Hold one of the MAX_CONCURRENT_QUERIES heavy query slots of this process while the block runs.
+
+    Requests over the limit queue for a slot, so under load latency grows with the queue
+    instead of every query slowing down on an oversubscribed CPU. Nested use in the same
+    thread reuses the slot it already holds.
+
+    Args:
+        cancelled (callable, optional): Returns True once the request is superseded; it then
+            leaves the queue instead of taking a slot.
+
+    Raises:
+        TimeoutError: If no slot frees up within QUERY_SLOT_TIMEOUT seconds.
+        QueryCancelled: If `cancelled()` turned True while queued.
+    """
+    if getattr(_query_slot_holder, 'held', False):
+        yield
+        return
+    deadline = time.monotonic() + QUERY_SLOT_TIMEOUT
+    with stage('query_slot_wait'):
+        while True:
+            if cancelled is not None and cancelled():
+                raise QueryCancelled
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"No query slot free after {QUERY_SLOT_TIMEOUT}s")
+            if _query_slots.acquire(timeout=min(remaining, _SLOT_POLL_SECONDS) if cancelled else remaining):
+                break
+    _query_slot_holder.held = True
+    try:
+        yield
+    finally:
+        _query_slot_holder.held = False
+        _query_slots.release()
+
+def heavy_collect(query: pl.LazyFrame, name: str, cancelled: Optional[Callable[[], bool]] = None, **kwargs) -> pl.DataFrame:
+    """
+    Collect a query as a stage while holding a query slot.
+
+    A running Polars query cannot be stopped, so a superseded request is dropped
+    while it waits for a slot or just before its query would start.
+
+    Args:
+        query (pl.LazyFrame): The query to collect.
+        name (str): Stage name.
+        cancelled (callable, optional): Returns True once the result is no longer wanted.
+        **kwargs: Passed to `LazyFrame.collect`.
+
     Returns:
-        plotly.graph_objects.Figure
+        pl.DataFrame: The collected frame.
+
+    Raises:
+        QueryCancelled: If the request was superseded before the query started.
     """
-    # function to to create x label with hospital count
-    def unique_hospital_count() -> pl.Expr:
-        return c.name.n_unique().over('drug_type_of_measurement').alias('hospital_count')
+    try:
+        with query_slot(cancelled):
+            if cancelled is not None and cancelled():
+                raise QueryCancelled
+            return collect(query, name, **kwargs)
+    except QueryCancelled:
+        metrics.count_cancelled_query(name)
+        raise
+
+class SessionRequests:
+    """
+    Latest request generation of each browser session, used to abandon superseded queries.
 
-    def drug_type_of_measurement_with_hospital_ct() -> pl.Expr:
-        return pl.format('{}\n({})', c.drug_type_of_measurement, unique_hospital_count()).alias('drug_type_of_measurement')
+    A session's generation advances whenever it sends a request for a new state
+    (selection and grid filter). Requests for an older state get a `superseded`
+    check that turns True, so their queued queries are dropped and their results
+    are never serialized. The browser numbers its requests, so one for an old state
+    that arrives late is recognised as superseded too.
 
-    df = (
-        df
+    Args:
+        max_sessions (int): Sessions tracked before the least recently active are forgotten.
+    """
+
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max_sessions
+        # session id -> (state, generation, request sequence number)
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+
+    def begin(self, session_id: Optional[str], state: Hashable, seq: Optional[int] = None) -> Callable[[], bool]:
+        """
+        Register a request and return a check that is True once the session has moved on.
+
+        Args:
+            session_id (str): Browser session id; None is never superseded.
+            state (hashable): What the request computes, e.g. selection and filter model.
+            seq (int, optional): The browser's request number; requests without one count as newest.
+
+        Returns:
+            callable: `superseded()`.
+        """
+        if session_id is None:
+            return lambda: False
+        with self._lock:
+            current = self._sessions.get(session_id)
+            if current is None:
+                current = (state, 0, seq)
+            elif current[0] != state:
+                if seq is not None and current[2] is not None and seq < current[2]:
+                    # an older state arriving late; the session has already moved on
+                    return lambda: True
+                current = (state, current[1] + 1, seq)
+            elif seq is not None and (current[2] is None or seq > current[2]):
+                current = (state, current[1], seq)
+            self._sessions[session_id] = current
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        generation = current[1]
+
+        def superseded() -> bool:
+            latest = self._sessions.get(session_id)
+            return latest is not None and latest[1] != generation
+        return superseded
+
+session_requests = SessionRequests(SESSION_REQUESTS_MAX)
+
+def data_version() -> str:
+    """
+    Version of the dataset being served.
+
+    Used in every cache key so a data refresh never serves results from the old files.
+
+    Returns:
+        str: The manifest version (or a file fingerprint when there is no manifest).
+    """
+    if dataset is None:
+        return current_version() or file_version(*SOURCE_FILES)
+    return dataset.version
+
+def selection_frame(how: str, value: str, cancelled: Optional[Callable[[], bool]] = None) -> pl.DataFrame:
+    """
+    Collect the payment rows joined to hospital data for a selection.
+
+    Looks in the in-process result cache, then in the spill store written by other
+    processes, and only then scans the payment data.
+
+    Args:
+        how (str): Selection type ('hcpcs' or 'ndc').
+        value (str): HCPCS description or product name.
+        cancelled (callable, optional): Returns True once the result is no longer wanted.
+
+    Returns:
+        pl.DataFrame: The collected selection data.
+    """
+    snapshot = dataset
+    key = ('selection', how, value, snapshot.version)
+    frame = result_cache.get(key)
+    if frame is None:
+        frame = spilled_selection_frame(how, value, cancelled, snapshot)
+        result_cache.put(key, frame)
+    return frame
+
+def spilled_selection_frame(how: str, value: str, cancelled: Optional[Callable[[], bool]] = None,
+                            snapshot: Optional[DatasetSnapshot] = None) -> pl.DataFrame:
+    """
+    Collect a selection through the spill store, without the in-process result cache.
+
+    Used by the background jobs: each job is a new process, so only what it spills
+    outlives it.
+
+    Args:
+        how (str): Selection type ('hcpcs' or 'ndc').
+        value (str): HCPCS description or product name.
+        cancelled (callable, optional): Returns True once the result is no longer wanted.
+        snapshot (DatasetSnapshot, optional): Dataset to read; defaults to the current one.
+
+    Returns:
+        pl.DataFrame: The collected selection data.
+    """
+    snapshot = snapshot or dataset
+    key = ('selection', how, value, snapshot.version)
+    frame = spill_store.get(key)
+    if frame is None:
+        query = filter_payment_info(how, value, snapshot).pipe(add_hospital_data, snapshot.hospital_dim)
+        frame = heavy_collect(query, 'selection_scan', cancelled, engine='streaming')
+        spill_store.put(key, frame)
+    return frame
+
+def selection_ready(how: str, value: str) -> bool:
+    """
+    Whether a selection's rows have been collected, by this process or spilled by another.
+
+    Until then (its background job is still running), grid blocks are served by
+    selection_block_json instead of waiting for the whole selection.
+
+    Args:
+        how (str): Selection type ('hcpcs' or 'ndc').
+        value (str): HCPCS description or product name.
+
+    Returns:
+        bool: True if selection_frame would not scan the payment data.
+    """
+    key = ('selection', how, value, dataset.version)
+    return key in result_cache or key in spill_store
+
+def selection_data(how: str, value: str, filter_model: Optional[dict] = None,
+                   cancelled: Optional[Callable[[], bool]] = None) -> pl.LazyFrame:
+    """
+    Build the grid dataset for a selection, optionally narrowed by the grid's filter model.
+
+    Args:
+        how (str): Selection type ('hcpcs' or 'ndc').
+        value (str): HCPCS description or product name.
+        filter_model (dict, optional): AG Grid filter model.
+        cancelled (callable, optional): Returns True once the result is no longer wanted.
+
+    Returns:
+        pl.LazyFrame: Payment rows joined to hospital data.
+    """
+    data = selection_frame(how, value, cancelled).lazy()
+    if filter_model:
+        data = data.filter(filter_model_expr(filter_model, data.collect_schema().names()))
+    return data
+
+def session_selection_frame(session_id: Optional[str], how: str, value: str, filter_model: Optional[dict] = None,
+                            cancelled: Optional[Callable[[], bool]] = None) -> pl.DataFrame:
+    """
+    Get a session's grid data with its filter model applied, computing it once per filter change.
+
+    The grid blocks, charts, modals and CSV export of a session all read the same
+    server-side frame, so the browser only sends the filter model.
+
+    Args:
+        session_id (str): Browser session id; None disables the session cache.
+        how (str): Selection type ('hcpcs' or 'ndc').
+        value (str): HCPCS description or product name.
+        filter_model (dict, optional): AG Grid filter model.
+        cancelled (callable, optional): Returns True once the result is no longer wanted.
+
+    Returns:
+        pl.DataFrame: The filtered selection data.
+    """
+    if not filter_model:
+        return selection_frame(how, value, cancelled)
+
+    state = (how, value, json.dumps(filter_model, sort_keys=True), data_version())
+    frame = session_frames.get(session_id, tag=state) if session_id else None
+    if frame is None:
+        frame = heavy_collect(selection_data(how, value, filter_model, cancelled), 'grid_filter', cancelled)
+        if session_id:
+            session_frames.put(session_id, frame, tag=state)
+    return frame
+
+def _text_condition(column: pl.Expr, condition: dict) -> pl.Expr:
+    kind = condition.get('type', 'contains')
+    if kind == 'blank':
+        return column.is_null()
+    if kind == 'notBlank':
+        return column.is_not_null()
+
+    text = column.cast(pl.String).str.to_lowercase()
+    value = str(condition.get('filter') or '').lower()
+    if kind == 'equals':
+        return text == value
+    if kind == 'notEqual':
+        return (text != value).fill_null(True)
+    if kind == 'startsWith':
+        return text.str.starts_with(value)
+    if kind == 'endsWith':
+        return text.str.ends_with(value)
+    if kind == 'notContains':
+        return (~text.str.contains(value, literal=True)).fill_null(True)
+    return text.str.contains(value, literal=True)
+
+def _range_condition(column: pl.Expr, kind: str, value, value_to) -> pl.Expr:
+    if kind == 'blank':
+        return column.is_null()
+    if kind == 'notBlank':
+        return column.is_not_null()
+    if kind == 'equals':
+        return column == value
+    if kind == 'notEqual':
+        return (column != value).fill_null(True)
+    if kind == 'lessThan':
+        return column < value
+    if kind == 'lessThanOrEqual':
+        return column <= value
+    if kind == 'greaterThan':
+        return column > value
+    if kind == 'greaterThanOrEqual':
+        return column >= value
+    if kind == 'inRange':
+        return column.is_between(value, value_to)
+    return pl.lit(True)
+
+def _parse_grid_date(value: Optional[str]):
+    return datetime.strptime(value[:10], '%Y-%m-%d').date() if value else None
+
+def _filter_condition(field: str, condition: dict) -> pl.Expr:
+    # combined conditions, e.g. {"operator": "AND", "conditions": [...]}
+    if 'conditions' in condition:
+        parts = [_filter_condition(field, part) for part in condition['conditions']]
+        if condition.get('operator') == 'OR':
+            return pl.any_horizontal(parts)
+        return pl.all_horizontal(parts)
+
+    column = c(field)
+    filter_type = condition.get('filterType', 'text')
+    if filter_type == 'number':
+        return _range_condition(column, condition.get('type'), condition.get('filter'), condition.get('filterTo'))
+    if filter_type == 'date':
+        return _range_condition(
+            column,
+            condition.get('type'),
+            _parse_grid_date(condition.get('dateFrom')),
+            _parse_grid_date(condition.get('dateTo'))
+        )
+    return _text_condition(column, condition)
+
+def filter_model_expr(filter_model: Optional[dict], columns: Optional[List[str]] = None) -> pl.Expr:
+    """
+    Translate an AG Grid filter model into a single Polars predicate.
+
+    Args:
+        filter_model (dict): Mapping of column field to AG Grid filter definition.
+        columns (list, optional): Columns available in the frame; filters on other fields are ignored.
+
+    Returns:
+        pl.Expr: Boolean expression combining every column filter.
+    """
+    conditions = [
+        _filter_condition(field, condition)
+        for field, condition in (filter_model or {}).items()
+        if columns is None or field in columns
+    ]
+    return pl.all_horizontal(conditions) if conditions else pl.lit(True)
+
+def sort_by_model(data: pl.LazyFrame, sort_model: Optional[List[dict]]) -> pl.LazyFrame:
+    """
+    Apply an AG Grid sort model to a LazyFrame.
+
+    Args:
+        data (pl.LazyFrame): The data to sort.
+        sort_model (list): List of {"colId": ..., "sort": "asc" | "desc"} entries.
+
+    Returns:
+        pl.LazyFrame: The sorted data (unchanged if no sort model is given).
+    """
+    if not sort_model:
+        return data
+    return data.sort(
+        [item['colId'] for item in sort_model],
+        descending=[item.get('sort') == 'desc' for item in sort_model],
+        nulls_last=True,
+        maintain_order=True
+    )
+
+def grid_block_json(data: pl.DataFrame, request: dict) -> str:
+    """
+    Serve one block of the infinite row model grid as column-oriented JSON.
+
+    The block is serialized by Polars straight from its columns, so no per-row Python
+    dicts are built and column names are sent once per block instead of once per row.
+    The browser turns the columns back into row objects.
+
+    Args:
+        data (pl.DataFrame): The selection data with the request's filter model already applied.
+        request (dict): AG Grid getRowsRequest with startRow, endRow and sortModel.
+
+    Returns:
+        str: JSON object with 'rowCount' (total filtered rows), 'rows' (rows in the block)
+             and 'columns' (column name -> list of values).
+    """
+    start = request.get('startRow') or 0
+    end = request.get('endRow') or start + 100
+
+    block = collect(sort_by_model(data.lazy(), request.get('sortModel')).slice(start, end - start), 'grid_block')
+    return _block_json(block, data.height)
+
+def selection_block_json(how: str, value: str, request: dict, cancelled: Optional[Callable[[], bool]] = None) -> str:
+    """
+    Serve one grid block for a selection whose rows are still being collected.
+
+    The block is sliced out of the selection's payment data query, so the first rows
+    reach the grid without waiting for the whole selection (see selection_ready).
+    The total row count is not known yet: 'rowCount' is -1 (the grid keeps asking for
+    more blocks) unless this block is the last one.
+
+    Args:
+        how (str): Selection type ('hcpcs' or 'ndc').
+        value (str): HCPCS description or product name.
+        request (dict): AG Grid getRowsRequest with startRow, endRow, sortModel and filterModel.
+        cancelled (callable, optional): Returns True once the result is no longer wanted.
+
+    Returns:
+        str: JSON object in the format of grid_block_json.
+    """
+    start = request.get('startRow') or 0
+    end = request.get('endRow') or start + 100
+
+    snapshot = dataset
+    query = filter_payment_info(how, value, snapshot).pipe(add_hospital_data, snapshot.hospital_dim)
+    if request.get('filterModel'):
+        query = query.filter(filter_model_expr(request['filterModel'], query.collect_schema().names()))
+    query = sort_by_model(query, request.get('sortModel')).slice(start, end - start)
+    block = heavy_collect(query, 'grid_partial_block', cancelled, engine='streaming')
+    return _block_json(block, start + block.height if block.height < end - start else -1)
+
+def _block_json(block: pl.DataFrame, row_count: int) -> str:
+    with stage('grid_block_json'):
+        columns = block.select(pl.all().implode()).write_ndjson().rstrip()
+    return f'{{"rowCount":{row_count},"rows":{block.height},"columns":{columns}}}'
+
+@timed()
+def grid_export_csv(data: pl.LazyFrame) -> str:
+    """
+    Render grid data as CSV using the visible grid columns and their header names.
+
+    Args:
+        data (pl.LazyFrame): The (filtered) grid data.
+
+    Returns:
+        str: CSV text.
+    """
+    def leaf_columns(defs):
+        for col_def in defs:
+            if 'children' in col_def:
+                yield from leaf_columns(col_def['children'])
+            elif not col_def.get('hide'):
+                yield col_def['field'], col_def['headerName']
+
+    headers = dict(leaf_columns(columnDefs))
+    with query_slot():
+        return data.select(list(headers)).rename(headers).collect().write_csv()
+
+@timed()
+def aggregate_chart_data(data: pl.LazyFrame) -> Dict[str, pl.DataFrame]:
+    """
+    Compute the hospital-level stats behind the map and the distribution plot in one pass.
+
+    Args:
+        data: LazyFrame of grid rows (payment data joined to hospital data)
+
+    Returns:
+        dict: 'hospital' - mean negotiated price per hospital with its name, state and location;
+              'unit' - price per unit per (hospital, drug type of measurement)
+    """
+    hospital = (
+        data
+        .group_by('hospital_unique_id')
+        .agg(
+            c.standard_charge_negotiated_dollar.mean(),
+            c.name.first(),
+            c.state.first(),
+            c.lat.first(),
+            c.long.first(),
+        )
+        .filter(c.standard_charge_negotiated_dollar.is_not_null())
+    )
+    unit = (
+        data
         #if drug_unit_of_measurement is null or 0 set to 1.0
         .with_columns(c.drug_unit_of_measurement.fill_null(1.0))
         # calculate price per unit
-        .group_by(c.name, c.drug_type_of_measurement)
+        .group_by(c.hospital_unique_id, c.name, c.drug_type_of_measurement)
         .agg(
             ((c.standard_charge_negotiated_dollar.mean() / c.drug_unit_of_measurement.mean())).round(2).alias('price_per_unit')
         )
-        .with_columns(drug_type_of_measurement_with_hospital_ct())
     )
+    with query_slot():
+        hospital, unit = pl.collect_all([hospital, unit])
+    return {'hospital': hospital, 'unit': unit}
+
+@timed()
+def stored_chart_aggregates(how: str, value: str,
+                            snapshot: Optional[DatasetSnapshot] = None) -> Optional[Dict[str, pl.DataFrame]]:
+    """
+    Read the chart stats for an unfiltered selection from the precomputed aggregate table.
+
+    The table holds sums and counts per (code, hospital, drug type of measurement), so
+    NDC selections spanning several codes combine exactly and the cost depends on the
+    number of hospitals rather than on the number of payment rows.
+
+    Args:
+        how (str): Selection type ('hcpcs' or 'ndc').
+        value (str): HCPCS description or product name.
+        snapshot (DatasetSnapshot, optional): The dataset to read; the current one by default.
+
+    Returns:
+        dict: Same shape as aggregate_chart_data, or None if the table is missing or stale.
+    """
+    if snapshot is None:
+        snapshot = dataset
+    if snapshot.chart_aggregates is None:
+        return None
+
+    index = snapshot.lookup_index
+    codes = [index.hcpcs_code(value)] if how == 'hcpcs' else index.ndc_codes(value)
+    per_unit = (
+        pl.scan_parquet(snapshot.chart_aggregates)
+        .filter((c.code_type == how) & c.code.is_in(codes))
+        .group_by(c.hospital_unique_id, c.drug_type_of_measurement)
+        .agg(cs.by_name('row_count', 'negotiated_count', 'negotiated_sum', 'unit_sum').sum())
+        .join(
+            snapshot.hospital_dim.lazy().select(c.unique_id, c.name, c.state, c.lat, c.long),
+            left_on='hospital_unique_id',
+            right_on='unique_id'
+        )
+    )
+    hospital = (
+        per_unit
+        .group_by('hospital_unique_id')
+        .agg(
+            (c.negotiated_sum.sum() / c.negotiated_count.sum()).alias('standard_charge_negotiated_dollar'),
+            c.negotiated_count.sum(),
+            c.name.first(),
+            c.state.first(),
+            c.lat.first(),
+            c.long.first(),
+        )
+        .filter(c.negotiated_count > 0)
+        .drop('negotiated_count')
+    )
+    unit = per_unit.select(
+        c.hospital_unique_id,
+        c.name,
+        c.drug_type_of_measurement,
+        pl.when(c.negotiated_count > 0)
+        .then((c.negotiated_sum / c.negotiated_count) / (c.unit_sum / c.row_count))
+        .round(2)
+        .alias('price_per_unit'),
+    )
+    with query_slot():
+        hospital, unit = pl.collect_all([hospital, unit])
+    return {'hospital': hospital, 'unit': unit}
+
+@timed()
+def chart_figures(how: str, value: str, filter_model: Optional[dict] = None, dense_map: Optional[bool] = None):
+    """
+    Build the map and distribution figures for a selection and grid filter.
+
+    Both figures come from one aggregation pass (or the precomputed aggregate table
+    when no grid filter is active). They are built in a background job, so they are
+    cached by the background callback manager rather than in this process.
+
+    Args:
+        how (str): Selection type ('hcpcs' or 'ndc').
+        value (str): HCPCS description or product name.
+        filter_model (dict, optional): AG Grid filter model.
+        dense_map (bool, optional): Draw the WebGL map (see create_map_visualization);
+            by default chosen by the number of hospitals on the map.
+
+    Returns:
+        tuple: (map figure, price distribution figure)
+    """
+    snapshot = dataset
+    # unfiltered selections are served from the precomputed aggregate table when available
+    aggregates = None if filter_model else stored_chart_aggregates(how, value, snapshot)
+    if aggregates is None:
+        data = spilled_selection_frame(how, value, snapshot=snapshot).lazy()
+        if filter_model:
+            data = data.filter(filter_model_expr(filter_model, data.collect_schema().names()))
+        aggregates = aggregate_chart_data(data)
+    return (
+        create_map_visualization(aggregates['hospital'], dense_map),
+        create_price_distribution_plot(aggregates['unit']),
+    )
+
+def _price_distribution_figure():
+    """
+    Create the price distribution box plot styling with plotly express.
 
+    Only used to build the figure template (see figure_template), from a one-row
+    placeholder rather than a Polars frame so it can be built before forking.
 
+    Returns:
+        plotly.graph_objects.Figure
+    """
     fig = px.box(
-        df.collect(),
+        {'drug_type_of_measurement': ['UN'], 'price_per_unit': [1.0]},
         x='drug_type_of_measurement',
         y='price_per_unit',
         color='drug_type_of_measurement',
@@ -253,53 +1437,37 @@ def create_price_distribution_plot(df):
     
     return fig
 
-def create_map_visualization(data: pl.LazyFrame):
+def _map_figure(dense: bool = False):
     """
-    Create a geographical visualization of hospital price distribution.
+    Create the hospital price map styling with plotly express.
+
+    Only used to build the figure template (see figure_template), from a one-row
+    placeholder rather than a Polars frame so it can be built before forking.
 
     Args:
-        data: LazyFrame containing hospital data with required columns:
-              hospital_unique_id, standard_charge_negotiated_dollar, lat, long, name, state
+        dense (bool): Build the WebGL map (scattermap) used for selections with many
+            hospitals instead of the SVG one (scattergeo).
 
     Returns:
         plotly.graph_objects.Figure: The configured map visualization
     """
-    # Aggregate the data and remove null values
-    map_data = (
-        data
-        .group_by(['hospital_unique_id'])
-        .agg(c.standard_charge_negotiated_dollar.mean())
-        .pipe(add_hospital_data)
-        .filter(c.standard_charge_negotiated_dollar.is_not_null())
-        .with_columns([
-            pl.min('standard_charge_negotiated_dollar').alias('price_min'),
-            pl.max('standard_charge_negotiated_dollar').alias('price_max'),            ((pl.col('standard_charge_negotiated_dollar') - pl.min('standard_charge_negotiated_dollar')) / 
-             (pl.max('standard_charge_negotiated_dollar') - pl.min('standard_charge_negotiated_dollar')) * 26 + 4)
-            .alias('marker_size')
-        ]
-        )
-        # set default marker size to 4.0 if null
-        .with_columns(c.marker_size.fill_nan(4.0))  # Fill null sizes with a default value
-        .collect()
-    )
-    
-    # calculate 5th and 95th percentile for color scale
-    lower_bound = map_data.select(c.standard_charge_negotiated_dollar.quantile(0.05)).item()
-    upper_bound = map_data.select(c.standard_charge_negotiated_dollar.quantile(0.95)).item()
-
     # Create map visualization
-    fig = px.scatter_geo(
-        data_frame=map_data,
+    fig = (px.scatter_map if dense else px.scatter_geo)(
+        data_frame={
+            'lat': [0.0], 'long': [0.0], 'marker_size': [4.0], 'standard_charge_negotiated_dollar': [1.0],
+            'name': ['name'], 'state': ['state'], 'hospital_unique_id': ['id'],
+        },
         lat='lat',
         lon='long',
         size='marker_size',  # Use the scaled size column
         color='standard_charge_negotiated_dollar',
-        scope='usa',
         custom_data=['name', 'state', 'standard_charge_negotiated_dollar', 'hospital_unique_id'],
         title='Hospital Price Distribution Across USA',
         color_continuous_scale='Viridis',
-        range_color=[lower_bound, upper_bound],  # Set color range based on percentiles
+        range_color=[0.0, 1.0],  # set per chart to the 5th-95th percentile
         height=500,
+        # the contiguous US, as the SVG map's usa scope shows it
+        **(dict(map_style=MAP_STYLE, center=dict(lat=38.5, lon=-96.5), zoom=2.8) if dense else dict(scope='usa')),
     )
 
     # Update hover template
@@ -322,18 +1490,6 @@ def create_map_visualization(data: pl.LazyFrame):
             font=dict(size=18, color='#2c3e50')
         ),
         paper_bgcolor='white',
-        geo=dict(
-            showland=True,
-            showlakes=True,
-            showcountries=True,
-            showsubunits=True,
-            landcolor='rgb(250, 250, 250)',
-            subunitcolor='rgb(217, 217, 217)',
-            countrycolor='rgb(217, 217, 217)',
-            lakecolor='rgb(255, 255, 255)',
-            bgcolor='white',
-            projection_scale=1.1
-        ),
         margin=dict(l=0, r=0, t=50, b=0),
         coloraxis_colorbar=dict(
             orientation='h',
@@ -348,40 +1504,219 @@ def create_map_visualization(data: pl.LazyFrame):
             tickformat='$,.0f'
         )
     )
+    if not dense:
+        fig.update_layout(
+            geo=dict(
+                showland=True,
+                showlakes=True,
+                showcountries=True,
+                showsubunits=True,
+                landcolor='rgb(250, 250, 250)',
+                subunitcolor='rgb(217, 217, 217)',
+                countrycolor='rgb(217, 217, 217)',
+                lakecolor='rgb(255, 255, 255)',
+                bgcolor='white',
+                projection_scale=1.1
+            )
+        )
     
     return fig
 
-def schema_for_fig_data():
+# plotly express's default size_max, which the map's marker sizeref is scaled to
+MAP_SIZE_MAX = 20
+
+# per-trace data the templates are stripped of
+_TEMPLATE_DATA_KEYS = {
+    'distribution': ('x', 'y', 'name', 'legendgroup', 'offsetgroup'),
+    'map': ('lat', 'lon', 'customdata'),
+    'dense_map': ('lat', 'lon', 'customdata'),
+}
+_TEMPLATE_FIGURES = {
+    'distribution': _price_distribution_figure,
+    'map': _map_figure,
+    'dense_map': lambda: _map_figure(dense=True),
+}
+_figure_templates: Dict[str, dict] = {}
+_figure_templates_lock = Lock()
+
+def figure_template(name: str) -> dict:
     """
-    Define the schema for the DataFrame used in the visualization.
-    
+    Get the layout and trace styling of a chart, built once from a placeholder figure.
+
+    Building a figure with plotly express and restyling it costs more than the chart
+    data itself, so the charts are assembled from this template and only their
+    data-dependent parts.
+
+    Args:
+        name (str): 'map', 'dense_map' or 'distribution'.
+
+    Returns:
+        dict: {'layout': layout dict, 'trace': trace dict without its data arrays}
+    """
+    template = _figure_templates.get(name)
+    if template is None:
+        with _figure_templates_lock:
+            figure = _TEMPLATE_FIGURES[name]()
+            figure = json.loads(figure.to_json())
+            trace = {key: value for key, value in figure['data'][0].items() if key not in _TEMPLATE_DATA_KEYS[name]}
+            template = _figure_templates[name] = {'layout': figure['layout'], 'trace': trace}
+    return template
+
+def _box_statistics(values: np.ndarray, max_outliers: int) -> dict:
+    """
+    Statistics of a box plot trace, computed the way plotly.js computes them from the raw values.
+
+    Quartiles use plotly's default 'linear' quartile method (numpy's 'hazen', which
+    none of Polars' quantile methods match) and the whiskers end at the furthest
+    values within 1.5 IQR of the box.
+
+    Args:
+        values: Sorted values of one box, without NaN.
+        max_outliers: Number of values outside the whiskers to keep.
+
     Returns:
-        dict: A dictionary defining the schema for the DataFrame.
+        dict: One-item q1, median, q3, lowerfence, upperfence and mean lists, and y
+              holding the outlier sample, evenly spaced so the extremes are kept.
     """
+    if not len(values):
+        return {'y': []}
+    q1, median, q3 = np.percentile(values, [25, 50, 75], method='hazen')
+    # first value at or above the lower bound, last value at or below the upper bound
+    low = np.searchsorted(values, 2.5 * q1 - 1.5 * q3, side='left')
+    high = np.searchsorted(values, 2.5 * q3 - 1.5 * q1, side='right')
+    lowerfence = min(q1, values[min(low, len(values) - 1)])
+    upperfence = max(q3, values[max(high - 1, 0)])
+    outliers = np.concatenate([
+        values[:np.searchsorted(values, lowerfence, side='left')],
+        values[np.searchsorted(values, upperfence, side='right'):],
+    ])
+    if len(outliers) > max_outliers:
+        outliers = outliers[np.linspace(0, len(outliers) - 1, max_outliers).round().astype(int)]
     return {
-        'description': pl.String,   
-        'ndc': pl.String,
-        'hcpcs': pl.String,
-        'setting': pl.String,
-        'drug_unit_of_measurement': pl.Int64,
-        'drug_type_of_measurement': pl.String,
-        'payer_name': pl.String,
-        'plan_name': pl.String,
-        'standard_charge_gross': pl.Float64,
-        'standard_charge_discounted_cash': pl.Float64,
-        'standard_charge_negotiated_dollar': pl.Float64,
-        'standard_charge_methodology': pl.String,
-        'standard_charge_negotiated_percentage': pl.Float64,
-        'calculated_negotiated_dollars': pl.Boolean,
-        'hospital_unique_id': pl.String,
-        'mapped_plan_name': pl.String,
-        'mapped_lob_name': pl.String,
-        'name': pl.String,
-        'state': pl.String,
-        'beds': pl.Int32,
-        'lat': pl.Float64,
-        'long': pl.Float64
+        'q1': [q1], 'median': [median], 'q3': [q3],
+        'lowerfence': [lowerfence], 'upperfence': [upperfence], 'mean': [values.mean()],
+        'y': [outliers],
+    }
+
+@timed()
+def create_price_distribution_plot(df: pl.DataFrame) -> dict:
+    """
+    Create a box plot showing price distribution by drug measurement type.
+
+    Up to DISTRIBUTION_MAX_POINTS prices are sent to the browser, which computes the
+    boxes. Above that, the quartiles, whiskers and mean of each box are computed
+    here and sent with a sample of its outliers (DISTRIBUTION_OUTLIER_SAMPLE).
+
+    Args:
+        df: Polars DataFrame from aggregate_chart_data()['unit'] with columns
+            'hospital_unique_id', 'name', 'drug_type_of_measurement' and 'price_per_unit'
+
+    Returns:
+        dict: Plotly figure, one box trace per drug type of measurement
+    """
+    template = figure_template('distribution')
+    precomputed = df.height > DISTRIBUTION_MAX_POINTS
+    # x label with the hospital count (one box point per hospital id), e.g. "ML\n(12)"
+    label = pl.format('{}\n({})', c.drug_type_of_measurement.first(), c.hospital_unique_id.n_unique()).alias('label')
+    if precomputed:
+        prices = c.price_per_unit.filter(c.price_per_unit.is_not_nan()).sort()
+    else:
+        prices = c.price_per_unit
+    groups = df.group_by('drug_type_of_measurement', maintain_order=True).agg(label, prices)
+
+    colors = px.colors.qualitative.Dark2
+    traces = []
+    for i, (label, prices) in enumerate(zip(groups['label'], groups['price_per_unit'])):
+        if precomputed:
+            # the outlier sample is drawn as the box's points and keeps the axis range of the full data
+            data = {'x': [label], 'boxpoints': 'outliers',
+                    **_box_statistics(prices.to_numpy(), DISTRIBUTION_OUTLIER_SAMPLE)}
+        else:
+            data = {'x': [label] * len(prices), 'y': prices.to_list()}
+        traces.append({
+            **template['trace'],
+            'name': label,
+            'legendgroup': label,
+            'offsetgroup': label,
+            'marker': {**template['trace']['marker'], 'color': colors[i % len(colors)]},
+            **data,
+        })
+    layout = {
+        **template['layout'],
+        'xaxis': {**template['layout']['xaxis'], 'categoryarray': groups['label'].to_list()},
+    }
+    return {'data': traces, 'layout': layout}
+
+@timed()
+def create_map_visualization(data: pl.DataFrame, dense: Optional[bool] = None) -> dict:
+    """
+    Create a geographical visualization of hospital price distribution.
+
+    Maps with more than MAP_MAX_SVG_POINTS hospitals are drawn with WebGL
+    (scattermap on the MAP_STYLE basemap) instead of SVG (scattergeo), which
+    slows down with every marker added.
+
+    Args:
+        data: DataFrame from aggregate_chart_data()['hospital'] with one row per hospital:
+              hospital_unique_id, standard_charge_negotiated_dollar, lat, long, name, state
+        dense (bool, optional): Force the WebGL (True) or SVG (False) map, e.g. to keep the
+              selection's map type while a grid filter narrows it down.
+
+    Returns:
+        dict: Plotly figure with one marker per hospital, sized and colored by its average price
+    """
+    if dense is None:
+        dense = data.height > MAP_MAX_SVG_POINTS
+    template = figure_template('dense_map' if dense else 'map')
+    price = c.standard_charge_negotiated_dollar
+    # Scale marker sizes to the price range, 4.0 where the range is empty
+    map_data = data.with_columns(
+        ((price - price.min()) / (price.max() - price.min()) * 26 + 4).fill_nan(4.0).alias('marker_size')
+    )
+    # calculate 5th and 95th percentile for color scale
+    lower_bound = map_data.select(price.quantile(0.05)).item()
+    upper_bound = map_data.select(price.quantile(0.95)).item()
+
+    trace = {
+        **template['trace'],
+        'lat': map_data['lat'].to_numpy(),
+        'lon': map_data['long'].to_numpy(),
+        'customdata': map_data.select('name', 'state', 'standard_charge_negotiated_dollar', 'hospital_unique_id').rows(),
+        'marker': {
+            **template['trace']['marker'],
+            'color': map_data['standard_charge_negotiated_dollar'].to_numpy(),
+            'size': map_data['marker_size'].to_numpy(),
+            'sizeref': (map_data['marker_size'].max() or 0) / MAP_SIZE_MAX ** 2,
+        },
+    }
+    layout = {
+        **template['layout'],
+        'coloraxis': {**template['layout']['coloraxis'], 'cmin': lower_bound, 'cmax': upper_bound},
     }
+    return {'data': [trace], 'layout': layout}
+
+# layout entries of each chart that depend on its data, sent along with the traces in a patch
+FIGURE_DATA_LAYOUT = {
+    'map': (('coloraxis', 'cmin'), ('coloraxis', 'cmax')),
+    'distribution': (('xaxis', 'categoryarray'),),
+}
+
+def figure_patch(figure: dict, name: str) -> Patch:
+    """
+    Build a partial update replacing a chart's data on a figure already showing the same template.
+
+    Args:
+        figure (dict): Figure from create_map_visualization or create_price_distribution_plot.
+        name (str): 'map' or 'distribution'.
+
+    Returns:
+        Patch: Replaces the traces and the data-dependent layout entries.
+    """
+    patch = Patch()
+    patch['data'] = figure['data']
+    for section, key in FIGURE_DATA_LAYOUT[name]:
+        patch['layout'][section][key] = figure['layout'][section][key]
+    return patch
 
 def load_price_data(path: Path = PRICE_PATH) -> pl.LazyFrame:
     """
@@ -395,17 +1730,6 @@ def load_price_data(path: Path = PRICE_PATH) -> pl.LazyFrame:
     """
     return pl.scan_parquet(path)
 
-def filter_price_data(value: str, how: str) -> pl.LazyFrame:
-    # how either 'ndc' or 'hcpcs'
-    data = load_price_data()
-    if how == 'ndc':
-        return data.filter(c.product == value)
-    elif how == 'hcpcs':
-        return data.filter(c.hcpcs == value)
-    else:
-        raise ValueError("Invalid filter type. Use 'ndc' or 'hcpcs'.")
-
-
 def create_hcpcs_description(df: pl.DataFrame) -> pl.DataFrame:
     """Create a combined HCPCS description column."""
     return df.with_columns(
@@ -415,71 +1739,135 @@ def create_hcpcs_description(df: pl.DataFrame) -> pl.DataFrame:
                  c.asp_dosage).alias('hcpcs_desc')
     )
 
-def summarize_prices(df: pl.LazyFrame) -> pl.LazyFrame:
+def summarize_all_prices(df: pl.LazyFrame) -> pl.LazyFrame:
     """
-    Summarize pricing data by creating a normalized view of ASP and product prices.
+    Summarize the prices of every product and HCPCS code in one pass.
+
+    Averages the numeric price columns per (product, HCPCS description, HCPCS code)
+    and normalizes them into one row per price: the ASP under the HCPCS description
+    and the other prices under the product name. Each row appears once under its
+    product ('ndc') and once under its HCPCS code ('hcpcs').
 
     Args:
         df: Input LazyFrame containing pricing data
+
     Returns:
-        LazyFrame with normalized price summaries
+        LazyFrame with columns how, key, desc, price_type and amount
     """
-    # Prepare HCPCS description
-    df = df.with_columns(
-        pl.format('{} - {} ({})', c.hcpcs, c.asp_desc, c.asp_dosage).alias('hcpcs_desc')
-    )
-
-    # Group and aggregate numeric columns
     processed_data = (
         df
+        .with_columns(pl.format('{} - {} ({})', c.hcpcs, c.asp_desc, c.asp_dosage).alias('hcpcs_desc'))
         .group_by(['product', 'hcpcs_desc', 'hcpcs'])
         .agg(cs.numeric().mean().round(2))
     )
 
-    # ASP summary
-    asp_prices = (
-        processed_data
-        .select([
-            c.hcpcs_desc.alias('desc'),
-            pl.lit('asp').alias('price_type'),
-            c.asp.alias('amount')
-        ])
-        .unique()
-        .filter(c.amount.is_not_null())
+    asp_prices = processed_data.select(
+        c.product,
+        c.hcpcs,
+        c.hcpcs_desc.alias('desc'),
+        pl.lit('asp').alias('price_type'),
+        c.asp.alias('amount'),
     )
-
-    # Product price summary
-    excluded_cols = {'hcpcs_desc', 'asp', 'hcpcs', 'product'}
     product_prices = (
         processed_data
-        .select(['product'] + [
-            col for col in processed_data.collect_schema().names() 
-            if col not in excluded_cols
-        ])
-        .rename({'product': 'desc'})
-        .unpivot(
-            index='desc',
-            variable_name='price_type',
-            value_name='amount'
+        .drop('hcpcs_desc', 'asp')
+        .with_columns(c.product.alias('desc'))
+        .unpivot(index=['product', 'hcpcs', 'desc'], variable_name='price_type', value_name='amount')
+    )
+
+    def keyed(prices: pl.LazyFrame, how: str, key: str) -> pl.LazyFrame:
+        return (
+            prices
+            .filter(c(key).is_not_null() & c.amount.is_not_null())
+            .select(pl.lit(how).alias('how'), c(key).alias('key'), 'desc', 'price_type', 'amount')
         )
-        .filter(c.amount.is_not_null())
+
+    # a selection's ASP rows are listed once, ahead of its product prices
+    return pl.concat([
+        keyed(asp_prices, 'ndc', 'product').unique(maintain_order=True),
+        keyed(asp_prices, 'hcpcs', 'hcpcs').unique(maintain_order=True),
+        keyed(product_prices, 'ndc', 'product'),
+        keyed(product_prices, 'hcpcs', 'hcpcs'),
+    ])
+
+def summarize_prices(prices: pl.LazyFrame) -> pl.DataFrame:
+    """
+    Collect the price panel rows of every product and HCPCS code, sorted by selection.
+
+    build_data.py writes these rows to PRICE_SUMMARIES_IPC.
+
+    Args:
+        prices: The price data.
+
+    Returns:
+        DataFrame with columns how, key, desc, price_type, amount and amount_text
+    """
+    return (
+        summarize_all_prices(prices)
+        .sort('how', 'key', maintain_order=True)
+        .with_columns(amount_text=pl.format('${}', c.amount))
+        .collect()
     )
 
-    return pl.concat([asp_prices, product_prices]).lazy()
+class PriceSummaries:
+    """
+    Price summaries precomputed for direct lookup.
+
+    The summary rows are sorted by selection, so each selection's frame is a
+    zero-copy slice, and the price panel tables are built once with formatted amounts.
+
+    Args:
+        summary (pl.DataFrame): Price panel rows, as returned by summarize_prices.
+    """
+
+    def __init__(self, summary: pl.DataFrame):
+        self.summary = summary.select('desc', 'price_type', 'amount')
+        runs = (
+            summary.with_row_index()
+            .group_by('how', 'key', maintain_order=True)
+            .agg(c.index.first().alias('offset'), pl.len())
+        )
+        # (how, value) -> (offset, length) of the selection's rows
+        self.slices: Dict[tuple, tuple] = {(how, key): (offset, length) for how, key, offset, length in runs.iter_rows()}
+        self.tables: Dict[tuple, dict] = {}
+        columns = summary.select('desc', 'price_type', 'amount_text').to_dict(as_series=False)
+        for key, (offset, length) in self.slices.items():
+            self.tables[key] = {
+                'desc': columns['desc'][offset:offset + length],
+                'price_type': columns['price_type'][offset:offset + length],
+                'amount': columns['amount_text'][offset:offset + length],
+            }
+
+    def frame(self, how: str, value: str) -> pl.DataFrame:
+        """Summary rows (desc, price_type, amount) of a selection; empty if it has no prices."""
+        offset, length = self.slices.get((how, value), (0, 0))
+        return self.summary.slice(offset, length)
 
 def fetch_summarized_prices(how: str, value: str) -> pl.LazyFrame:
     """
-    Fetch and summarize prices based on the specified filter.
+    Fetch the precomputed price summary for a selection.
     
     Args:
         how: Filter type ('ndc' or 'hcpcs')
-        value: Value to filter by
+        value: Product name or HCPCS code
 
     Returns:
         LazyFrame containing the summarized prices
     """
-    filtered_data = filter_price_data(value, how)
-    return summarize_prices(filtered_data)
+    return dataset.selection_prices(how, value).frame(how, value).lazy()
+
+def price_table(how: str, value: str) -> Optional[dict]:
+    """
+    Get the formatted price panel table for a selection.
+
+    Args:
+        how: Filter type ('ndc' or 'hcpcs')
+        value: Product name or HCPCS code
+
+    Returns:
+        dict: Column name to formatted values, or None if there are no prices.
+    """
+    return dataset.selection_prices(how, value).tables.get((how, value))
 
 
 def create_mantine_dictionary():
@@ -571,11 +1959,15 @@ def get_hcpcs_code_from_desc(hcpcs_desc: str) -> str:
     Returns:
         str: The corresponding HCPCS code.
     """
-    return hcpcs_data.filter(c("hcpcs_desc") == hcpcs_desc).select(c("hcpcs")).collect().item()
+    return get_hcpcs_code(hcpcs_desc)
 
 
     
 
+# load the dataset now unless gunicorn defers it to the workers
+if LOAD_DATA_ON_IMPORT:
+    load_datasets()
+
 if __name__ == "__main__":
     pass
     #hospital340B.collect().glimpse()
@@ -0,0 +1,385 @@
+"""
+Lightweight timing and size metrics for the callbacks and the query/figure helpers.
+
+Stages are recorded with `timed` (decorator), `stage` (context manager) or
+`collect` (a LazyFrame collect that also reports slow query plans). Dash response
+sizes are recorded per callback output, and everything is served in Prometheus
+text format at /metrics by `init_app`.
+
+The web workers and the background job processes each record into their own
+`Metrics`, and `flush` adds what was recorded since the last flush to a totals file
+in METRICS_DIR shared by all of them, so /metrics reports the whole server whichever
+worker answers the scrape. Web processes flush from a background thread (`start_flusher`)
+and at exit, job processes when their callback returns. Only the cache gauges are per
+process, labelled by pid.
+"""
+import atexit
+import json
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Callable, Dict, Optional, Tuple
+
+import dash
+import polars as pl
+from dash.exceptions import PreventUpdate
+from flask import Flask, Response, g, request
+
+from config import LOG_SLOW_QUERY_PLANS, METRICS_DIR, METRICS_FLUSH_SECONDS, SLOW_QUERY_SECONDS
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the single-process development server runs there
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1_024, 10_240, 102_400, 512_000, 1_048_576, 5_242_880, 20_971_520, 104_857_600)
+# counter name -> help text, all labelled by stage
+COUNTERS = {
+    'pra_stage_rows_total': 'Rows produced by each stage.',
+    'pra_stage_errors_total': 'Exceptions raised by each stage.',
+    'pra_slow_queries_total': f'Queries slower than {SLOW_QUERY_SECONDS}s.',
+    'pra_cancelled_queries_total': 'Queries skipped because their request was superseded.',
+}
+
+
+class Histogram:
+    """Cumulative histogram of observations per label set, in the Prometheus layout."""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series: Dict[str, list] = {}
+
+    def observe(self, label_value: str, value: float) -> None:
+        # [per-bucket counts..., +Inf count, sum]; only called under Metrics._lock
+        series = self._series.setdefault(label_value, [0] * (len(self.buckets) + 1) + [0.0])
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def drain(self) -> Dict[str, list]:
+        """Return the series observed since the last call and start new ones."""
+        series, self._series = self._series, {}
+        return series
+
+    def render(self, series_by_label: Dict[str, list]) -> list:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_value, series in sorted(series_by_label.items()):
+            labels = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class Metrics:
+    """
+    Thread-safe registry of stage timings, row counts, errors and Dash response sizes.
+
+    Observations accumulate in memory until `flush` merges them into the totals file
+    shared by every process, which is what `render` reports.
+    """
+
+    def __init__(self, directory: Path = METRICS_DIR):
+        self._lock = Lock()
+        self._path = directory / 'totals.json'
+        self._lock_path = directory / 'totals.lock'
+        self.stage_seconds = Histogram(
+            'pra_stage_duration_seconds', 'Wall time of callbacks and pipeline stages.', 'stage', LATENCY_BUCKETS)
+        self.response_bytes = Histogram(
+            'pra_dash_response_bytes', 'Serialized size of Dash callback responses.', 'output', SIZE_BUCKETS)
+        self.response_seconds = Histogram(
+            'pra_dash_request_duration_seconds', 'Wall time of Dash callback requests including serialization.',
+            'output', LATENCY_BUCKETS)
+        self._histograms = (self.stage_seconds, self.response_bytes, self.response_seconds)
+        # counter name -> {label value: count since the last flush}
+        self._counts: Dict[str, Dict[str, int]] = {name: {} for name in COUNTERS}
+        # name -> callable returning {label: {stat: value}}, e.g. cache stats
+        self._collectors: Dict[str, Callable[[], Dict[str, Dict[str, int]]]] = {}
+
+    def _count(self, counter: str, label_value: str, amount: int = 1) -> None:
+        # only called under self._lock
+        counts = self._counts[counter]
+        counts[label_value] = counts.get(label_value, 0) + amount
+
+    def observe_stage(self, stage: str, seconds: float, rows: Optional[int] = None, error: bool = False) -> None:
+        with self._lock:
+            self.stage_seconds.observe(stage, seconds)
+            if rows is not None:
+                self._count('pra_stage_rows_total', stage, rows)
+            if error:
+                self._count('pra_stage_errors_total', stage)
+
+    def observe_response(self, output: str, size: int, seconds: float) -> None:
+        with self._lock:
+            self.response_bytes.observe(output, size)
+            self.response_seconds.observe(output, seconds)
+
+    def count_slow_query(self, stage: str) -> None:
+        with self._lock:
+            self._count('pra_slow_queries_total', stage)
+
+    def count_cancelled_query(self, stage: str) -> None:
+        with self._lock:
+            self._count('pra_cancelled_queries_total', stage)
+
+    def register_collector(self, name: str, collect_stats: Callable[[], Dict[str, Dict[str, int]]]) -> None:
+        """Expose `pra_<name>_<stat>{<name>="<label>",pid="<pid>"}` gauges computed at scrape time."""
+        self._collectors[name] = collect_stats
+
+    def flush(self) -> None:
+        """Add everything observed since the last flush to the shared totals."""
+        with self._lock:
+            histograms = {histogram.name: histogram.drain() for histogram in self._histograms}
+            counts, self._counts = self._counts, {name: {} for name in COUNTERS}
+        if not any(histograms.values()) and not any(counts.values()):
+            return
+        try:
+            with self._locked_totals() as totals:
+                for name, series_by_label in histograms.items():
+                    merged = totals['histograms'].setdefault(name, {})
+                    for label_value, series in series_by_label.items():
+                        previous = merged.get(label_value)
+                        merged[label_value] = series if previous is None else [
+                            total + value for total, value in zip(previous, series)
+                        ]
+                for name, values in counts.items():
+                    merged = totals['counters'].setdefault(name, {})
+                    for label_value, value in values.items():
+                        merged[label_value] = merged.get(label_value, 0) + value
+        except OSError as e:
+            print(f"Error flushing metrics: {e}")
+
+    @contextmanager
+    def _locked_totals(self):
+        """Yield the shared totals for update under an exclusive lock, then write them back."""
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            totals = self._read_totals()
+            yield totals
+            temporary = self._path.with_name(f'{self._path.name}.{os.getpid()}.tmp')
+            temporary.write_text(json.dumps(totals))
+            os.replace(temporary, self._path)
+
+    def _read_totals(self) -> dict:
+        try:
+            return json.loads(self._path.read_text())
+        except (OSError, ValueError):
+            return {'histograms': {}, 'counters': {}}
+
+    def reset(self) -> None:
+        """Drop the shared totals, e.g. when the server starts."""
+        self._path.unlink(missing_ok=True)
+
+    def render(self) -> str:
+        self.flush()
+        totals = self._read_totals()
+        lines = []
+        for histogram in self._histograms:
+            lines += histogram.render(totals['histograms'].get(histogram.name, {}))
+        for name, help_text in COUNTERS.items():
+            lines += _counter(name, help_text, 'stage', totals['counters'].get(name, {}))
+        pid = os.getpid()
+        for name, collect_stats in self._collectors.items():
+            by_stat: Dict[str, Dict[str, int]] = {}
+            for label_value, stats in collect_stats().items():
+                for stat, value in stats.items():
+                    by_stat.setdefault(stat, {})[label_value] = value
+            for stat, values in by_stat.items():
+                metric = f'pra_{name}_{stat}'
+                lines += [f'# TYPE {metric} gauge']
+                lines += [
+                    f'{metric}{{{name}="{_escape(label)}",pid="{pid}"}} {value}' for label, value in sorted(values.items())
+                ]
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _counter(name: str, help_text: str, label: str, values: Dict[str, int]) -> list:
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+    return lines + [f'{name}{{{label}="{_escape(key)}"}} {value}' for key, value in sorted(values.items())]
+
+
+metrics = Metrics()
+# observations since the last periodic flush are not lost when a worker shuts down
+atexit.register(metrics.flush)
+
+
+def _flush_periodically(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        metrics.flush()
+
+
+def start_flusher(interval: float = METRICS_FLUSH_SECONDS) -> Optional[Thread]:
+    """
+    Add this process's metrics to the shared totals every `interval` seconds in a daemon thread.
+
+    Requests only record in memory, so none of them waits on the totals file lock.
+
+    Args:
+        interval (float): Seconds between flushes; 0 disables the thread.
+
+    Returns:
+        Thread: The flusher thread, or None if disabled.
+    """
+    if interval <= 0:
+        return None
+    thread = Thread(target=_flush_periodically, args=(interval,), name='metrics-flusher', daemon=True)
+    thread.start()
+    return thread
+
+
+def row_count(result) -> Optional[int]:
+    """Rows in a stage result: frame height, grid block size or the sum over a dict of frames."""
+    if isinstance(result, pl.DataFrame):
+        return result.height
+    if isinstance(result, dict):
+        if 'rowData' in result:
+            return len(result['rowData'])
+        if result and all(isinstance(value, pl.DataFrame) for value in result.values()):
+            return sum(value.height for value in result.values())
+    return None
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as a stage."""
+    start = perf_counter()
+    try:
+        yield
+    except PreventUpdate:
+        metrics.observe_stage(name, perf_counter() - start)
+        raise
+    except Exception:
+        metrics.observe_stage(name, perf_counter() - start, error=True)
+        raise
+    metrics.observe_stage(name, perf_counter() - start)
+
+
+def timed(name: Optional[str] = None):
+    """
+    Decorator recording the wall time, row count and errors of a function as a stage.
+
+    Args:
+        name (str, optional): Stage name; defaults to the function name.
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except PreventUpdate:
+                metrics.observe_stage(stage_name, perf_counter() - start)
+                raise
+            except Exception:
+                metrics.observe_stage(stage_name, perf_counter() - start, error=True)
+                raise
+            metrics.observe_stage(stage_name, perf_counter() - start, row_count(result))
+            return result
+        return wrapper
+    return decorator
+
+
+def callback(*args, **kwargs):
+    """
+    Drop-in replacement for `dash.callback` that times every call as `callback:<function name>`.
+
+    A background callback's metrics are flushed after each call, since it runs in a job
+    process that exits (without running atexit handlers) when it returns.
+    """
+    register = dash.callback(*args, **kwargs)
+    background = kwargs.get('background', False)
+
+    def decorator(func):
+        timed_func = timed(f'callback:{func.__name__}')(func)
+        if not background:
+            return register(timed_func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return timed_func(*args, **kwargs)
+            finally:
+                metrics.flush()
+        return register(wrapper)
+    return decorator
+
+
+def collect(query: pl.LazyFrame, name: str, **kwargs) -> pl.DataFrame:
+    """
+    Collect a LazyFrame as a stage, reporting it (and optionally its plan) when slow.
+
+    Args:
+        query (pl.LazyFrame): The query to collect.
+        name (str): Stage name.
+        **kwargs: Passed to `LazyFrame.collect`.
+
+    Returns:
+        pl.DataFrame: The collected frame.
+    """
+    start = perf_counter()
+    try:
+        frame = query.collect(**kwargs)
+    except Exception:
+        metrics.observe_stage(name, perf_counter() - start, error=True)
+        raise
+    elapsed = perf_counter() - start
+    metrics.observe_stage(name, elapsed, frame.height)
+    if elapsed >= SLOW_QUERY_SECONDS:
+        metrics.count_slow_query(name)
+        print(f"Slow query {name}: {elapsed:.2f}s, {frame.height:,} rows")
+        if LOG_SLOW_QUERY_PLANS:
+            print(query.explain(engine=kwargs.get('engine', 'auto')))
+    return frame
+
+
+def init_app(server: Flask, routes: Tuple[str, ...] = ()) -> None:
+    """
+    Record Dash response sizes and serve the metrics at /metrics.
+
+    Args:
+        server (Flask): The Dash app's Flask server.
+        routes (tuple): Other data routes whose response sizes are recorded, labelled by path.
+    """
+    @server.before_request
+    def start_timer():
+        g.metrics_start = perf_counter()
+
+    @server.after_request
+    def record_response(response):
+        if request.path.endswith('/_dash-update-component') and not response.direct_passthrough:
+            body = request.get_json(silent=True) or {}
+            output = body.get('output', 'unknown')
+            metrics.observe_response(
+                output.strip('.'), response.calculate_content_length() or 0, perf_counter() - g.metrics_start
+            )
+        elif request.path in routes and not response.direct_passthrough:
+            metrics.observe_response(
+                request.path, response.calculate_content_length() or 0, perf_counter() - g.metrics_start
+            )
+        return response
+
+    @server.route('/metrics')
+    def serve_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
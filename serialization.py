@@ -0,0 +1,64 @@
+"""
+orjson serialization for Dash callback responses.
+
+Dash encodes every callback response with plotly's `to_json_plotly`, which walks the
+whole response in Python before handing it to the encoder (for the orjson engine
+each string array element is visited separately). `dumps` lets orjson walk the
+response itself and only calls back into Python for figures, components and
+numpy object arrays.
+"""
+import numpy as np
+import orjson
+import plotly.io as pio
+import plotly.io.json as pio_json
+from plotly.utils import PlotlyJSONEncoder
+
+_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+_plotly_encoder = PlotlyJSONEncoder()
+_to_json_plotly = pio_json.to_json_plotly
+
+
+def _default(value):
+    # figures and Dash components
+    if hasattr(value, 'to_plotly_json'):
+        return value.to_plotly_json()
+    # string / mixed arrays (numeric arrays are handled by orjson itself)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return _plotly_encoder.default(value)
+
+
+def dumps(value) -> str:
+    """
+    Serialize a Dash response (figures, components, numpy arrays, dates) to JSON.
+
+    NaN and infinite floats become null, as with plotly's encoder.
+
+    Args:
+        value: The object to serialize.
+
+    Returns:
+        str: JSON text.
+    """
+    return orjson.dumps(value, default=_default, option=_OPTIONS).decode()
+
+
+def to_json_plotly(plotly_object, pretty: bool = False, engine=None) -> str:
+    if pretty or engine is not None:
+        return _to_json_plotly(plotly_object, pretty=pretty, engine=engine)
+    return dumps(plotly_object)
+
+
+def install() -> None:
+    """
+    Serialize Dash responses with `dumps`.
+
+    Dash looks up `plotly.io.json.to_json_plotly` on every response, so replacing it
+    there switches all callback responses over; explicit `pretty`/`engine` calls still
+    go to plotly. Figures serialized through plotly directly (`fig.to_json()`) use
+    its orjson engine.
+    """
+    pio.json.config.default_engine = 'orjson'
+    pio_json.to_json_plotly = to_json_plotly
@@ -25,9 +25,18 @@ class UIComponents:
             dmc.Select(
                 id='selection-dropdown',
                 searchable=True,
+                debounce=150,
                 placeholder="Search for a procedure or medication..."
             )
         ], className='dropdown-container')
+
+    @staticmethod
+    def create_selection_progress():
+        """Create the progress bar shown while a selection loads"""
+        return dmc.Stack([
+            dmc.Progress(id='selection-progress', value=0, size='sm', striped=True, animated=True),
+            dmc.Text(id='selection-status', size='xs', c='dimmed'),
+        ], id='selection-progress-box', gap=4, style={'display': 'none'})
     
     @staticmethod
     def create_control_buttons():
@@ -233,12 +242,13 @@ class UIComponents:
                     columnDefs=columnDefs,
                     defaultColDef=defaultColDef,
                     dashGridOptions=dashGridOptions,
-                    csvExportParams={"fileName": "hospital_data.csv"},
+                    rowModelType='infinite',
                     style={'height': '500px'}
                 ),
                 opened=True, 
                 id='collapse-grid'
-            )
+            ),
+            dcc.Download(id='csv-download'),
         ], shadow='sm')
     
     @staticmethod
@@ -279,6 +289,7 @@ class UIComponents:
                         'marginBottom': '0.5rem',
                     }
                 ),
+                UIComponents.create_selection_progress(),
                 # Actions section moved directly under dropdown
                 dmc.Divider(mb='xs'),
                 dmc.Text("Actions", size="sm", style={'color': '#888', 'marginBottom': '0.2rem', 'marginTop': '0.2rem', 'fontWeight': 500}),